@@ -1,3 +1,4 @@
+import time
 from plugins.tyhh.tyhh import TongyiDrawingPlugin
 
 def login_cli():
@@ -30,7 +31,8 @@ def login_cli():
         if cookie:
             # 更新配置
             plugin.config["cookie"] = cookie
-            plugin._save_config()
+            plugin.config["credentials_updated_at"] = time.time()
+            plugin._save_config(immediate=True)
             print("登录成功！配置已更新")
             return True
         else:
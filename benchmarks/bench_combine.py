@@ -0,0 +1,72 @@
+"""合并图片基准测试：统计不同尺寸的输入合并一张4宫格图片的耗时
+
+在宿主项目根目录运行：
+    python plugins/tyhh/benchmarks/bench_combine.py [轮数]
+"""
+import os
+import sys
+import tempfile
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PLUGIN_DIR, os.path.dirname(os.path.dirname(PLUGIN_DIR))]
+
+from PIL import Image
+from image_processor import ImageProcessor
+
+# 通义返回的图片尺寸
+SIZES = [(1024, 1024), (1280, 720), (720, 1280)]
+FORMATS = [("PNG", ".png"), ("JPEG", ".jpg")]
+RESAMPLES = ["lanczos", "bilinear"]
+
+
+def make_sources(directory, size, fmt, ext):
+    """生成4张渐变叠加少量噪点的测试图片，接近真实生成图片的压缩率"""
+    paths = []
+    for i in range(4):
+        noise = Image.effect_noise(size, 8 + i * 4).convert('RGB')
+        gradient = Image.merge('RGB', [
+            Image.linear_gradient('L').resize(size),
+            Image.radial_gradient('L').resize(size),
+            Image.linear_gradient('L').rotate(90).resize(size)
+        ])
+        img = Image.blend(gradient, noise, 0.3)
+        path = os.path.join(directory, f"src_{size[0]}x{size[1]}_{i}{ext}")
+        img.save(path, fmt)
+        paths.append(path)
+    return paths
+
+
+def bench(processor, paths, output_path, rounds):
+    """返回每次合并的平均耗时（毫秒）"""
+    processor.combine_images(paths, output_path)  # 预热，创建复用画布
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if not processor.combine_images(paths, output_path):
+            raise RuntimeError("合并失败")
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "merged.jpg")
+        # 第一列包含500KB输出预算下的质量搜索，第二列不限制输出大小，只反映解码和合成的开销
+        print(f"{'输入':<12}{'格式':<6}{'滤镜':<10}{'流式':<7}{'500KB预算(ms)':>14}{'不限大小(ms)':>14}")
+        for size in SIZES:
+            for fmt, ext in FORMATS:
+                paths = make_sources(directory, size, fmt, ext)
+                for resample in RESAMPLES:
+                    for streaming in (True, False):
+                        costs = []
+                        for max_output_bytes in (500 * 1024, None):
+                            processor = ImageProcessor(directory, resample=resample, streaming=streaming,
+                                                       max_decode_bytes=64 * 1024 * 1024,
+                                                       max_output_bytes=max_output_bytes)
+                            costs.append(bench(processor, paths, output_path, rounds))
+                        label = f"{size[0]}x{size[1]}"
+                        print(f"{label:<12}{fmt:<6}{resample:<10}{str(streaming):<7}{costs[0]:>14.1f}{costs[1]:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
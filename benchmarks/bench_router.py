@@ -0,0 +1,93 @@
+"""命令路由基准测试：在模拟的聊天消息语料上比较前缀表路由和逐个startswith判断的耗时
+
+语料中约99%的消息不是插件命令。在宿主项目根目录或插件目录下运行：
+    python plugins/tyhh/benchmarks/bench_router.py [消息数]
+"""
+import os
+import random
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+from command_router import CommandRouter
+
+# 与TongyiDrawingPlugin._build_router相同的命令表
+COMMANDS = [
+    ("通义积分", True),
+    ("通义手绘", False),
+    ("通义上传", False),
+    ("通义批量", False),
+    ("通义", False),
+    ("t ", False),
+]
+
+CHAT_MESSAGES = [
+    "哈哈哈哈", "好的", "收到", "晚上吃什么", "[捂脸]", "明天几点开会？", "ok",
+    "这个链接打不开 https://example.com/a/b?c=1", "通知：本周五下午团建", "谁有充电宝",
+    "通常来说不会这样", "通过了吗", "同意", "the meeting is at 3pm", "thanks!", "tomorrow?",
+    "@张三 看一下这个", "今天天气不错", "我先下了", "周末去爬山吗", "1", "？？？",
+    "发个红包吧", "路上堵车了，晚点到", "这个价格还能便宜点吗", "图片已收到",
+]
+
+PLUGIN_MESSAGES = [
+    "通义 一只猫 -16:9", "通义积分", "通义手绘 山水 -水彩", "通义上传 油画风格 -油画",
+    "通义批量\n一只猫\n一只狗", "t 1718102345 2",
+]
+
+
+def make_corpus(size, command_ratio=0.01, seed=42):
+    rng = random.Random(seed)
+    return [
+        rng.choice(PLUGIN_MESSAGES) if rng.random() < command_ratio else rng.choice(CHAT_MESSAGES)
+        for _ in range(size)
+    ]
+
+
+def build_router():
+    router = CommandRouter()
+    for prefix, exact in COMMANDS:
+        router.add(prefix, prefix, exact=exact)
+    return router
+
+
+def startswith_chain(content):
+    """原来的匹配方式：按顺序逐个判断"""
+    for prefix, exact in COMMANDS:
+        if content == prefix if exact else content.startswith(prefix):
+            return prefix
+    return None
+
+
+def bench(match, corpus, rounds=5):
+    """返回每条消息的平均耗时（纳秒），取多轮中的最小值"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for content in corpus:
+            match(content)
+        cost = (time.perf_counter_ns() - start) / len(corpus)
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    corpus = make_corpus(size)
+    router = build_router()
+
+    # 两种方式的匹配结果必须一致
+    for content in set(corpus):
+        assert router.match(content) == startswith_chain(content), content
+
+    commands = sum(1 for content in corpus if router.match(content) is not None)
+    router_cost = bench(router.match, corpus)
+    chain_cost = bench(startswith_chain, corpus)
+    print(f"消息数: {size}，其中插件命令 {commands} 条")
+    print(f"前缀表路由: {router_cost:.0f} ns/条")
+    print(f"逐个startswith: {chain_cost:.0f} ns/条")
+
+
+if __name__ == "__main__":
+    main()
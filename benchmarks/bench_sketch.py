@@ -0,0 +1,116 @@
+"""手绘预处理基准测试：统计涂鸦和照片输入的预处理耗时、内存峰值和输出大小
+
+在宿主项目根目录运行：
+    python plugins/tyhh/benchmarks/bench_sketch.py [轮数]
+"""
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PLUGIN_DIR, os.path.dirname(os.path.dirname(PLUGIN_DIR))]
+
+from PIL import Image, ImageDraw
+from image_processor import ImageProcessor
+
+TARGET_SIZE = (1024, 1024)
+MODES = ["L", "1"]
+
+
+def make_doodle(size, fmt):
+    """白色画布上的彩色线条，模拟用户在空白画布上的涂鸦"""
+    rng = random.Random(size[0])
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        points = [(rng.randrange(size[0]), rng.randrange(size[1])) for _ in range(4)]
+        color = tuple(rng.randrange(200) for _ in range(3))
+        draw.line(points, fill=color, width=rng.randrange(3, 12))
+    buffer = BytesIO()
+    img.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def make_photo(size):
+    """带噪点的渐变，模拟手机照片"""
+    noise = Image.effect_noise(size, 30).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+    buffer = BytesIO()
+    Image.blend(gradient, noise, 0.4).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+INPUTS = [
+    ("涂鸦 1024x1024 PNG", lambda: make_doodle((1024, 1024), 'PNG')),
+    ("涂鸦 1280x720 JPEG", lambda: make_doodle((1280, 720), 'JPEG')),
+    ("照片 4000x3000 JPEG", lambda: make_photo((4000, 3000))),
+]
+
+
+def peak_rss_mb(path, mode):
+    """在新的子进程中预处理一次，返回峰值RSS增量（MB）"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--peak", path, mode],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return None
+
+
+def measure_peak(path, mode):
+    """子进程入口：输出一次预处理的峰值RSS增量
+    Linux下先重置VmHWM，避免导入模块时的峰值掩盖预处理的峰值；其他系统使用ru_maxrss
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        before = _status_kb('VmRSS')
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        ImageProcessor.preprocess_sketch(data, TARGET_SIZE, mode)
+        after = _status_kb('VmHWM')
+    except OSError:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        ImageProcessor.preprocess_sketch(data, TARGET_SIZE, mode)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print((after - before) / 1024)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'输入':<20}{'输入(KB)':>10}{'模式':>6}{'耗时(ms)':>10}{'峰值内存(MB)':>14}{'输出(KB)':>10}")
+        for index, (label, make) in enumerate(INPUTS):
+            data = make()
+            path = os.path.join(directory, f"input_{index}")
+            with open(path, 'wb') as f:
+                f.write(data)
+            for mode in MODES:
+                output = ImageProcessor.preprocess_sketch(data, TARGET_SIZE, mode)
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    ImageProcessor.preprocess_sketch(data, TARGET_SIZE, mode)
+                cost = (time.perf_counter() - start) * 1000 / rounds
+                peak = peak_rss_mb(path, mode)
+                print(f"{label:<20}{len(data) / 1024:>10.0f}{mode:>6}{cost:>10.1f}{peak:>14.1f}{len(output) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--peak":
+        measure_peak(sys.argv[2], sys.argv[3])
+    else:
+        main()
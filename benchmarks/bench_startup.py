@@ -0,0 +1,71 @@
+"""启动耗时基准测试：统计插件模块导入和插件初始化的耗时，并检查图片处理依赖是否被提前加载
+
+在宿主项目根目录运行（插件初始化会读取插件目录下的config.json）：
+    python plugins/tyhh/benchmarks/bench_startup.py [次数]
+每次测量都在新的子进程中进行，避免模块缓存影响结果。
+"""
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST_DIR = os.path.dirname(os.path.dirname(PLUGIN_DIR))
+
+# 首次使用时才应加载的模块
+LAZY_MODULES = ["PIL", "numpy", "plugins.tyhh.image_processor"]
+
+
+def measure_once():
+    """子进程入口：输出导入耗时、初始化耗时（毫秒）和已加载的延迟模块"""
+    sys.path.insert(0, HOST_DIR)
+    os.chdir(HOST_DIR)
+    # 提前导入插件依赖的宿主框架模块，使其耗时不计入插件导入耗时
+    for module in ("plugins", "bridge.context", "bridge.reply"):
+        importlib.import_module(module)
+    # 与PluginManager扫描插件时一样先设置插件路径，否则@register会报 Plugin path not set
+    from plugins import PluginManager
+    PluginManager().current_plugin_path = os.path.join("./plugins", os.path.basename(PLUGIN_DIR))
+
+    start = time.perf_counter()
+    from plugins.tyhh.tyhh import TongyiDrawingPlugin
+    imported = time.perf_counter()
+    TongyiDrawingPlugin()
+    initialized = time.perf_counter()
+
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+    print(f"{(imported - start) * 1000:.1f} {(initialized - imported) * 1000:.1f} {','.join(loaded) or '-'}")
+    sys.stdout.flush()
+    # 不等待后台签到等线程，直接退出
+    os._exit(0)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    import_costs, init_costs, loaded = [], [], set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--once"],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        import_cost, init_cost, modules = result.stdout.strip().splitlines()[-1].split()
+        import_costs.append(float(import_cost))
+        init_costs.append(float(init_cost))
+        if modules != '-':
+            loaded.update(modules.split(','))
+
+    print(f"运行次数: {runs}")
+    print(f"模块导入耗时(ms): 中位数 {statistics.median(import_costs):.1f}，最大 {max(import_costs):.1f}")
+    print(f"插件初始化耗时(ms): 中位数 {statistics.median(init_costs):.1f}，最大 {max(init_costs):.1f}")
+    print(f"启动时已加载的延迟模块: {', '.join(sorted(loaded)) or '无'}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--once":
+        measure_once()
+    else:
+        main()
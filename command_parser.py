@@ -0,0 +1,143 @@
+import re
+
+# 比例 -> 分辨率
+RATIO_RESOLUTIONS = {
+    "1:1": "1024*1024",
+    "16:9": "1280*720",
+    "9:16": "720*1280",
+    "4:3": "1152*864",
+    "3:4": "864*1152"
+}
+
+# 风格参数 -> 风格代码
+STYLE_CODES = {
+    "扁平": "<flat illustration>",
+    "油画": "<oil painting>",
+    "二次元": "<anime>",
+    "水彩": "<watercolor>",
+    "3D": "<3d cartoon>",
+    "彩绘": "<watercolor>"
+}
+
+DEFAULT_RESOLUTION = "1024*1024"
+MAX_COUNT = 4
+
+
+class DrawRequest:
+    """解析后的绘画命令"""
+
+    def __init__(self, command, prompt, ratio=None, style=None, count=None, ratios=None):
+        """
+        Args:
+            command: 命令前缀，如"通义手绘"
+            prompt: 去掉参数后的提示词
+            ratio: 比例，如"16:9"，未指定时为None
+            style: 风格代码，未指定时为None
+            count: 需要的图片数量，未指定时为None
+            ratios: 同时生成的多个比例，如["1:1", "16:9"]，ratio为其中第一个
+        """
+        self.command = command
+        self.prompt = prompt
+        self.ratio = ratio
+        self.style = style
+        self.count = count
+        self.ratios = ratios or ([ratio] if ratio else [])
+
+    @property
+    def resolution(self):
+        return RATIO_RESOLUTIONS.get(self.ratio, DEFAULT_RESOLUTION)
+
+    @property
+    def is_fan_out(self):
+        """是否指定了多个比例"""
+        return len(self.ratios) > 1
+
+    def to_dict(self):
+        """转换为可JSON序列化的dict，用于保存到会话状态"""
+        return {
+            "command": self.command,
+            "prompt": self.prompt,
+            "ratio": self.ratio,
+            "resolution": self.resolution,
+            "style": self.style,
+            "count": self.count,
+            "ratios": self.ratios
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        ratio = data.get("ratio")
+        if ratio is None and data.get("resolution"):
+            # 兼容只保存了分辨率的旧状态
+            ratio = next((r for r, res in RATIO_RESOLUTIONS.items() if res == data["resolution"]), None)
+        return cls(data.get("command", ""), data.get("prompt", ""), ratio, data.get("style"), data.get("count"),
+                   data.get("ratios"))
+
+    def __repr__(self):
+        return (f"DrawRequest(command={self.command!r}, prompt={self.prompt!r}, ratio={self.ratio!r}, "
+                f"style={self.style!r}, count={self.count!r}, ratios={self.ratios!r})")
+
+
+class CommandParser:
+    """命令解析器
+
+    参数以"-"开头，可以出现在提示词中的任意位置：
+        -16:9  比例
+        -1:1/16:9/9:16  同时生成多个比例
+        -油画   风格
+        -2张    图片数量
+    所有参数由一个预编译的正则表达式在一次扫描中提取，其余内容作为提示词。
+    """
+
+    # 序号从1开始
+    ENLARGE_PATTERN = re.compile(r'^t\s+(\d+)\s+0*([1-9]\d*)$')
+
+    def __init__(self, ratios=None, styles=None):
+        self.ratios = ratios or RATIO_RESOLUTIONS
+        self.styles = styles or STYLE_CODES
+        # 较长的参数优先匹配
+        ratio_alt = '|'.join(re.escape(r) for r in sorted(self.ratios, key=len, reverse=True))
+        style_alt = '|'.join(re.escape(s) for s in sorted(self.styles, key=len, reverse=True))
+        self.pattern = re.compile(
+            rf'-(?:(?P<ratio>(?:{ratio_alt})(?:/(?:{ratio_alt}))*)|(?P<style>{style_alt})|(?P<count>\d+)张)(?=\s|-|$)',
+            re.IGNORECASE
+        )
+
+    def parse(self, content, command):
+        """解析绘画命令
+        Args:
+            content: 消息内容
+            command: 命令前缀，会从内容开头去掉
+        Returns:
+            DrawRequest
+        """
+        text = content[len(command):] if content.startswith(command) else content
+        flags = {}
+
+        def take(match):
+            if match.group("ratio"):
+                ratios = []
+                for ratio in match.group("ratio").split("/"):
+                    if ratio not in ratios:
+                        ratios.append(ratio)
+                flags["ratio"] = ratios[0]
+                flags["ratios"] = ratios
+            elif match.group("style"):
+                key = match.group("style")
+                flags["style"] = self.styles.get(key) or self.styles.get(key.upper())
+            else:
+                flags["count"] = max(1, min(MAX_COUNT, int(match.group("count"))))
+            return " "
+
+        prompt = " ".join(self.pattern.sub(take, text).split())
+        return DrawRequest(command, prompt, flags.get("ratio"), flags.get("style"), flags.get("count"), flags.get("ratios"))
+
+    def parse_enlarge(self, content):
+        """解析放大命令 't 图片ID 序号'
+        Returns:
+            tuple: (图片ID, 从0开始的序号)，格式错误时返回None
+        """
+        match = self.ENLARGE_PATTERN.match(content.strip())
+        if not match:
+            return None
+        return match.group(1), int(match.group(2)) - 1
@@ -0,0 +1,35 @@
+class CommandRouter:
+    """命令路由表
+
+    按命令前缀的前key_length个字符建立索引，初始化时构建一次。
+    绝大多数消息不是插件命令，只需一次dict查找即可排除；
+    命中索引后按前缀从长到短匹配，保证"通义手绘"优先于"通义"。
+    """
+
+    def __init__(self, key_length=2):
+        self.key_length = key_length
+        self._table = {}  # 索引键 -> [(前缀, 是否完全匹配, 处理函数)]
+
+    def add(self, prefix, handler, exact=False):
+        """添加命令
+        Args:
+            prefix: 命令前缀，长度不能小于key_length
+            handler: 处理函数
+            exact: 是否要求消息与前缀完全相同
+        """
+        if len(prefix) < self.key_length:
+            raise ValueError(f"命令前缀过短: {prefix}")
+        routes = self._table.setdefault(prefix[:self.key_length], [])
+        routes.append((prefix, exact, handler))
+        routes.sort(key=lambda route: len(route[0]), reverse=True)
+        return self
+
+    def match(self, content):
+        """查找消息对应的处理函数，不是插件命令时返回None"""
+        routes = self._table.get(content[:self.key_length])
+        if routes is None:
+            return None
+        for prefix, exact, handler in routes:
+            if content == prefix if exact else content.startswith(prefix):
+                return handler
+        return None
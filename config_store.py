@@ -0,0 +1,168 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from common.log import logger
+
+
+class ConfigStore:
+    """配置文件存储
+
+    - 写入先写临时文件再重命名，进程中途退出也不会留下不完整的配置文件
+    - 短时间内的多次保存合并为一次写入
+    - 配置文件被修改（mtime变化）后自动重新加载，无需重启
+    配置数据始终是同一个dict对象（data），重新加载时原地更新，已持有的引用保持有效。
+    """
+
+    def __init__(self, path, defaults=None, lock=None, debounce=2.0, check_interval=1.0,
+                 before_write=None, on_reload=None):
+        """
+        Args:
+            path: 配置文件路径
+            defaults: 配置文件不存在时写入的默认配置
+            lock: 写入时持有的锁（如跨进程文件锁），为None时只使用线程锁
+            debounce: 保存请求合并的等待时间（秒）
+            check_interval: 检查文件是否被修改的最短间隔（秒）
+            before_write: 写入前在锁内调用的函数，用于合并其他进程的修改
+            on_reload: 重新加载后调用的函数，参数为重新加载前的配置
+        """
+        self.path = path
+        self.lock = lock or threading.RLock()
+        self.debounce = debounce
+        self.check_interval = check_interval
+        self.before_write = before_write
+        self.on_reload = on_reload
+        self.data = {}
+        self._mtime = None
+        self._last_check = 0
+        self._dirty = False
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        self.write_count = 0
+        self.reload_count = 0
+        self._load(defaults or {})
+
+    def _load(self, defaults):
+        """首次加载，文件不存在时写入默认配置"""
+        if not os.path.exists(self.path):
+            self.data.update(defaults)
+            try:
+                self._write()
+                logger.info("[TYHH] 创建默认配置文件")
+            except Exception as e:
+                logger.error(f"[TYHH] 创建默认配置文件失败: {e}")
+            return
+        disk_config = self.read_file()
+        if disk_config is None:
+            # 文件损坏时使用默认配置运行，但不覆盖原文件，便于手动修复
+            logger.error(f"[TYHH] 配置文件无法解析，暂时使用默认配置: {self.path}")
+            self.data.update(defaults)
+            return
+        self.data.update(disk_config)
+        self._mtime = self._stat_mtime()
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read_file(self):
+        """读取配置文件当前内容，失败时返回None"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else None
+        except Exception:
+            return None
+
+    def _write(self):
+        """原子写入：写临时文件、刷盘后重命名覆盖"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._mtime = self._stat_mtime()
+        self.write_count += 1
+
+    def save(self, immediate=False):
+        """请求保存，debounce时间内的多次请求合并为一次写入
+        Args:
+            immediate: 立即写入，用于凭证等需要马上对其他进程可见、不能因退出而丢失的修改
+        """
+        with self._timer_lock:
+            self._dirty = True
+            if self.debounce > 0 and not immediate:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.debounce, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """立即写入未保存的修改"""
+        with self._timer_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return True
+            self._dirty = False
+        try:
+            with self.lock:
+                if self.before_write:
+                    self.before_write()
+                self._write()
+            logger.info("[TYHH] 配置文件保存成功")
+            return True
+        except Exception as e:
+            self._dirty = True
+            logger.error(f"[TYHH] 保存配置文件失败: {e}")
+            return False
+
+    def reload_if_changed(self):
+        """配置文件被修改后重新加载，检查频率不超过check_interval
+        Returns:
+            bool: 是否重新加载
+        """
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        mtime = self._stat_mtime()
+        if mtime is None or mtime == self._mtime or self._dirty:
+            # 有未保存的修改时不加载，避免丢失，写入时会覆盖文件
+            return False
+        disk_config = self.read_file()
+        if disk_config is None:
+            logger.warning("[TYHH] 配置文件已修改但无法解析，保留当前配置")
+            self._mtime = mtime
+            return False
+
+        # 原地更新：先写入新值再删除已移除的键
+        previous = dict(self.data)
+        self.data.update(disk_config)
+        for key in [key for key in self.data if key not in disk_config]:
+            self.data.pop(key, None)
+        self._mtime = mtime
+        self.reload_count += 1
+        logger.info("[TYHH] 配置文件已修改，重新加载")
+        if self.on_reload:
+            try:
+                self.on_reload(previous)
+            except Exception as e:
+                logger.error(f"[TYHH] 重新加载配置后处理失败: {e}")
+        return True
@@ -0,0 +1,154 @@
+import importlib.util
+import os
+import site
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from common.log import logger
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_worker_module():
+    """以顶层模块名加载image_worker，提交的函数在子进程中按顶层模块名导入，不经过插件包"""
+    module = sys.modules.get("image_worker")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("image_worker", os.path.join(PLUGIN_DIR, "image_worker.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["image_worker"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+def _read_shared(out, discard=False):
+    """读取并释放子进程写入结果的共享内存
+    Args:
+        out: image_worker.run_on_shared的返回值
+        discard: 只释放不读取
+    """
+    if out is None:
+        return None
+    name, size = out
+    result_shm = shared_memory.SharedMemory(name=name)
+    try:
+        return None if discard else bytes(result_shm.buf[:size])
+    finally:
+        result_shm.close()
+        result_shm.unlink()
+
+
+def _discard_result(future):
+    """已超时放弃的任务完成后，释放其结果占用的共享内存"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        _read_shared(future.result(), discard=True)
+    except Exception as e:
+        logger.warning(f"[TYHH] 释放超时任务的共享内存失败: {e}")
+
+
+class ImageExecutor:
+    """图片处理进程池，避免CPU密集的图片处理占用GIL阻塞其他消息"""
+
+    def __init__(self, max_workers=None):
+        # max_workers为0时直接在调用线程中执行
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self._pool = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        """懒加载进程池"""
+        with self._lock:
+            if self._pool is None:
+                # 插件运行在多线程进程中，fork可能复制其他线程持有的锁，子进程使用spawn启动；
+                # 子进程不导入插件包，插件目录加入sys.path后按顶层模块名导入image_worker
+                self._worker = _load_worker_module()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=get_context("spawn"),
+                    initializer=site.addsitedir,
+                    initargs=(PLUGIN_DIR,)
+                )
+                logger.info(f"[TYHH] 图片处理进程池已启动, 进程数: {self.max_workers}")
+            return self._pool
+
+    def _reset_pool(self):
+        """进程池异常后丢弃，下次使用时重建"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def warm_up(self):
+        """提前启动所有子进程，避免首个任务承担进程启动开销"""
+        if not self.max_workers:
+            return
+        try:
+            pool = self._get_pool()
+            futures = [pool.submit(os.getpid) for _ in range(self.max_workers)]
+            for future in futures:
+                future.result()
+        except BrokenProcessPool as e:
+            logger.error(f"[TYHH] 图片处理进程池预热失败: {e}")
+            self._reset_pool()
+
+    def run(self, func, *args, timeout=None):
+        """在进程池中执行func，func需为插件模块中的函数、静态方法或属性可序列化的实例的方法
+        Args:
+            timeout: 等待结果的超时时间（秒），超时抛出TimeoutError
+        Returns:
+            func的返回值
+        """
+        if not self.max_workers:
+            return func(*args)
+        try:
+            pool = self._get_pool()
+            return pool.submit(self._worker.run, self._worker.task_ref(func), args).result(timeout=timeout)
+        except BrokenProcessPool as e:
+            logger.error(f"[TYHH] 图片处理进程池异常，改为当前线程执行: {e}")
+            self._reset_pool()
+            return func(*args)
+
+    def run_with_buffer(self, func, data, *args, timeout=None):
+        """通过共享内存将图片数据交给子进程处理
+        Args:
+            func: 处理函数，签名为 func(data, *args) -> bytes
+            data: 图片数据
+            timeout: 等待结果的超时时间（秒），超时抛出TimeoutError
+        Returns:
+            bytes: 处理后的数据，失败时返回None
+        """
+        if not self.max_workers:
+            return func(data, *args)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            pool = self._get_pool()
+            future = pool.submit(self._worker.run_on_shared, self._worker.task_ref(func), shm.name, len(data), args)
+            try:
+                out = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # 未开始的任务直接取消，已在运行的任务完成后释放其输出
+                if not future.cancel():
+                    future.add_done_callback(_discard_result)
+                raise
+        except BrokenProcessPool as e:
+            logger.error(f"[TYHH] 图片处理进程池异常，改为当前线程执行: {e}")
+            self._reset_pool()
+            return func(data, *args)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return _read_shared(out)
+
+    def shutdown(self, wait=True):
+        """关闭进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
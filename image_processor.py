@@ -2,14 +2,53 @@ import os
 import io
 import time
 import requests
-from PIL import Image
+from PIL import Image, ImageDraw, ImageFont, ImageMath, ImageOps
 from common.log import logger
 from io import BytesIO
 import math
 
+# 缩放滤镜映射
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "box": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+    "hamming": Image.Resampling.HAMMING,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+
+# 输出格式映射: 配置名 -> (PIL格式, 扩展名)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+
+# 按尺寸复用的画布（进程级，进程池中的每个子进程各自复用）
+_canvas_pool = {}
+
+
+def _image_math(expression, **images):
+    """按表达式逐像素计算，兼容Pillow 10.3之前只有ImageMath.eval的版本"""
+    if hasattr(ImageMath, "unsafe_eval"):
+        return ImageMath.unsafe_eval(expression, **images)
+    return ImageMath.eval(expression, **images)
+
 class ImageProcessor:
-    def __init__(self, temp_dir):
+    def __init__(self, temp_dir, resample="lanczos", streaming=False, max_decode_bytes=None,
+                 output_format="jpeg", max_output_bytes=None, subsampling=None):
         self.temp_dir = temp_dir
+        self.resample = RESAMPLE_FILTERS.get(str(resample).lower(), Image.Resampling.LANCZOS)
+        # 流式模式：逐张解码、缩放、粘贴并立即释放
+        self.streaming = streaming
+        # 单张图片解码内存上限（字节），None表示不限制
+        self.max_decode_bytes = max_decode_bytes
+        # 输出编码：格式、字节预算（None表示不限制）和JPEG色度抽样
+        self.output_format, self.output_extension = OUTPUT_FORMATS.get(
+            str(output_format).lower(), OUTPUT_FORMATS["jpeg"])
+        self.max_output_bytes = max_output_bytes
+        self.subsampling = subsampling
+        # 空白画布缓存: 分辨率 -> PNG数据
+        self._blank_canvases = {}
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
 
@@ -18,6 +57,167 @@ class ImageProcessor:
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir)
 
+    def _read_source(self, path):
+        """读取图片来源，本地路径原样返回，URL返回下载后的压缩数据"""
+        if path.startswith('http'):
+            response = requests.get(path, timeout=30)
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}")
+            return BytesIO(response.content)
+        return path
+
+    def _load_scaled(self, img, target_size):
+        """按目标尺寸缩小解码，返回等比例缩放后的RGB图片
+        Args:
+            img: 尚未解码的PIL图片
+            target_size: 单元格尺寸 (宽, 高)
+        Returns:
+            Image: 缩放后的RGB图片，超出解码内存上限时返回None
+        """
+        source = img
+        width, height = img.size
+        ratio = min(target_size[0] / width, target_size[1] / height)
+        new_size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+        # 目标尺寸本身超出内存上限时，以更小的尺寸解码后再放大
+        decode_size = new_size
+        if self.max_decode_bytes:
+            limit_pixels = self.max_decode_bytes // 4
+            if new_size[0] * new_size[1] > limit_pixels:
+                scale = math.sqrt(limit_pixels / (new_size[0] * new_size[1]))
+                decode_size = (max(1, int(new_size[0] * scale)), max(1, int(new_size[1] * scale)))
+
+        # JPEG使用draft模式，直接以1/2、1/4、1/8的比例解码
+        if img.format == 'JPEG':
+            img.draft('RGB', decode_size)
+
+        # 无法缩小解码的图片超出上限时跳过
+        if self.max_decode_bytes and img.size[0] * img.size[1] * 4 > self.max_decode_bytes:
+            logger.warning(f"[TYHH] Image {img.size[0]}x{img.size[1]} exceeds decode memory limit, skipped")
+            return None
+
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+        target_mode = 'RGBA' if has_alpha else 'RGB'
+        if img.mode != target_mode:
+            img = img.convert(target_mode)
+
+        # 其他格式先按整数倍快速缩小，再做精确缩放
+        factor = min(img.size[0] // new_size[0], img.size[1] // new_size[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.size != new_size:
+            img = img.resize(new_size, self.resample)
+
+        # 透明图片铺白底
+        if has_alpha:
+            bg = Image.new('RGB', img.size, 'white')
+            bg.paste(img, mask=img.getchannel('A'))
+            img = bg
+        # 无需转换和缩放时（如JPEG恰好按目标尺寸解码）复制一份，调用方随后会关闭原图
+        if img is source:
+            img = img.copy()
+        return img
+
+    def _acquire_canvas(self, size):
+        """获取指定尺寸的白色画布，优先复用已有画布"""
+        canvas = _canvas_pool.pop(size, None)
+        if canvas is None:
+            return Image.new('RGB', size, 'white')
+        canvas.paste((255, 255, 255), (0, 0) + size)
+        return canvas
+
+    def _release_canvas(self, canvas):
+        """归还画布以便下次复用"""
+        _canvas_pool[canvas.size] = canvas
+
+    def _encode(self, img, quality):
+        """按配置格式和指定质量编码图片"""
+        buffer = BytesIO()
+        if self.output_format == 'JPEG':
+            params = {"quality": quality, "optimize": True, "progressive": True}
+            if self.subsampling is not None:
+                params["subsampling"] = self.subsampling
+        else:
+            params = {"quality": quality, "method": 4}
+        img.save(buffer, self.output_format, **params)
+        return buffer.getvalue()
+
+    def encode_image(self, img, max_quality=95, min_quality=40):
+        """编码输出图片，设置了字节预算时二分查找满足预算的最高质量
+        Args:
+            img: RGB图片
+            max_quality: 最高质量
+            min_quality: 最低质量，仍超出预算时使用该质量
+        Returns:
+            bytes: 编码后的图片数据
+        """
+        data = self._encode(img, max_quality)
+        if not self.max_output_bytes or len(data) <= self.max_output_bytes:
+            return data
+
+        best = None
+        low, high = min_quality, max_quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            candidate = self._encode(img, quality)
+            if len(candidate) <= self.max_output_bytes:
+                best = candidate
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is None:
+            logger.warning(f"[TYHH] Image exceeds output budget even at quality {min_quality}")
+            best = self._encode(img, min_quality)
+        return best
+
+    def reencode(self, data):
+        """将下载的图片按输出配置重新编码
+        Args:
+            data: 原始图片数据
+        Returns:
+            bytes: 重新编码后的数据，不比原图小时返回原始数据
+        """
+        with Image.open(BytesIO(data)) as img:
+            if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+                rgba = img.convert('RGBA')
+                rgb = Image.new('RGB', rgba.size, 'white')
+                rgb.paste(rgba, mask=rgba.getchannel('A'))
+            else:
+                rgb = img.convert('RGB')
+        encoded = self.encode_image(rgb)
+        return encoded if len(encoded) < len(data) else data
+
+    @staticmethod
+    def _grid_layout(num_images):
+        """计算合并图片的行列数"""
+        if num_images == 1:
+            return 1, 1
+        elif num_images == 2:
+            return 2, 1
+        elif num_images <= 4:
+            return 2, 2
+        cols = math.ceil(math.sqrt(num_images))
+        rows = math.ceil(num_images / cols)
+        return cols, rows
+
+    @staticmethod
+    def _target_cell_size(original_sizes):
+        """根据原图尺寸计算单元格尺寸"""
+        max_width = max(size[0] for size in original_sizes)
+        max_height = max(size[1] for size in original_sizes)
+        aspect_ratio = max_width / max_height
+
+        if aspect_ratio > 1.5:  # 宽屏图片
+            target_width = 1024
+            target_height = int(target_width / aspect_ratio)
+        elif aspect_ratio < 0.67:  # 竖屏图片
+            target_height = 1024
+            target_width = int(target_height * aspect_ratio)
+        else:  # 接近方形的图片
+            target_width = target_height = 512
+        return target_width, target_height
+
     def combine_images(self, image_paths, output_path):
         """将多张图片合并为一张2x2的图片
         Args:
@@ -26,107 +226,61 @@ class ImageProcessor:
         Returns:
             bool: 是否成功
         """
+        pil_images = []
+        canvas = None
         try:
             # 确保临时目录存在
             self.ensure_temp_dir()
             
-            # 获取所有图片
-            pil_images = []
-            original_sizes = []
+            # 打开所有图片（此时只读取了文件头）
+            entries = []  # (图片来源或PIL图片, 原始尺寸)
             for path in image_paths[:4]:  # 最多处理4张图片
                 try:
-                    if path.startswith('http'):
-                        response = requests.get(path, timeout=30)
-                        if response.status_code == 200:
-                            img_data = BytesIO(response.content)
-                            img = Image.open(img_data)
-                            pil_images.append(img)
-                            original_sizes.append(img.size)
+                    source = self._read_source(path)
+                    img = Image.open(source)
+                    if self.streaming:
+                        # 流式模式只记录尺寸，粘贴时再逐张解码
+                        entries.append((source, img.size))
+                        img.close()
                     else:
-                        img = Image.open(path)
                         pil_images.append(img)
-                        original_sizes.append(img.size)
+                        entries.append((img, img.size))
                 except Exception as e:
                     logger.error(f"[TYHH] Failed to load image from {path}: {e}")
                     continue
 
-            if not pil_images:
+            if not entries:
                 logger.error("[TYHH] No valid images to combine")
                 return False
             
-            # 计算最佳目标尺寸
-            max_width = max(size[0] for size in original_sizes)
-            max_height = max(size[1] for size in original_sizes)
-            aspect_ratio = max_width / max_height
-            
-            # 根据图片数量和比例确定目标尺寸
-            if aspect_ratio > 1.5:  # 宽屏图片
-                target_width = 1024
-                target_height = int(target_width / aspect_ratio)
-            elif aspect_ratio < 0.67:  # 竖屏图片
-                target_height = 1024
-                target_width = int(target_height * aspect_ratio)
-            else:  # 接近方形的图片
-                target_width = target_height = 512
-            
-            # 等比例缩放图片
-            resized_images = []
-            for img, orig_size in zip(pil_images, original_sizes):
-                # 计算缩放比例
-                width, height = orig_size
-                ratio = min(target_width / width, target_height / height)
-                new_size = (int(width * ratio), int(height * ratio))
-                
-                # 缩放图片
-                resized = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # 创建透明背景
-                padded = Image.new('RGBA', (target_width, target_height), (255, 255, 255, 0))
-                
-                # 将缩放后的图片居中粘贴
-                x = (target_width - new_size[0]) // 2
-                y = (target_height - new_size[1]) // 2
-                if resized.mode == 'RGB':
-                    resized = resized.convert('RGBA')
-                padded.paste(resized, (x, y))
-                
-                resized_images.append(padded)
-            
-            # 计算合并图片的布局
-            num_images = len(resized_images)
-            if num_images == 1:
-                cols, rows = 1, 1
-            elif num_images == 2:
-                cols, rows = 2, 1
-            elif num_images <= 4:
-                cols, rows = 2, 2
-            else:
-                cols = math.ceil(math.sqrt(num_images))
-                rows = math.ceil(num_images / cols)
+            # 计算单元格尺寸和布局
+            target_width, target_height = self._target_cell_size([size for _, size in entries])
+            cols, rows = self._grid_layout(len(entries))
             
             # 创建空白画布，添加边距
             margin = 4  # 分割线宽度
             canvas_width = cols * target_width + (cols - 1) * margin
             canvas_height = rows * target_height + (rows - 1) * margin
+            canvas = self._acquire_canvas((canvas_width, canvas_height))
             
-            # 使用白色背景
-            canvas = Image.new('RGB', (canvas_width, canvas_height), 'white')
-            
-            # 粘贴图片到画布
-            for idx, img in enumerate(resized_images):
-                x = (idx % cols) * (target_width + margin)
-                y = (idx // cols) * (target_height + margin)
-                # 将RGBA图片转换为RGB并粘贴到画布上
-                if img.mode == 'RGBA':
-                    # 创建白色背景
-                    bg = Image.new('RGB', img.size, 'white')
-                    bg.paste(img, mask=img.split()[3])  # 使用alpha通道作为mask
-                    canvas.paste(bg, (x, y))
+            # 缩小解码后直接居中粘贴到画布
+            for idx, (entry, _) in enumerate(entries):
+                if self.streaming:
+                    with Image.open(entry) as img:
+                        scaled = self._load_scaled(img, (target_width, target_height))
                 else:
-                    canvas.paste(img, (x, y))
+                    scaled = self._load_scaled(entry, (target_width, target_height))
+                if scaled is None:
+                    continue
+                x = (idx % cols) * (target_width + margin) + (target_width - scaled.size[0]) // 2
+                y = (idx // cols) * (target_height + margin) + (target_height - scaled.size[1]) // 2
+                canvas.paste(scaled, (x, y))
+                # 立即释放，避免多张图片同时驻留内存
+                scaled.close()
             
             # 保存合并后的图片
-            canvas.save(output_path, 'JPEG', quality=95)
+            with open(output_path, 'wb') as f:
+                f.write(self.encode_image(canvas))
             logger.info(f"[TYHH] Successfully saved combined image to {output_path}")
             
             return True
@@ -135,6 +289,8 @@ class ImageProcessor:
             logger.error(f"[TYHH] Error combining images: {e}")
             return False
         finally:
+            if canvas is not None:
+                self._release_canvas(canvas)
             # 清理PIL图片对象
             for img in pil_images:
                 try:
@@ -142,17 +298,188 @@ class ImageProcessor:
                 except:
                     pass
 
-    def cleanup_temp_files(self):
-        """清理临时文件"""
+    def contact_sheet(self, entries, output_path, tile_height=512, label_height=40):
+        """将多张不同比例的图片缩放到相同高度后横向排列，并在每张图片下方标注文字
+        Args:
+            entries: [(图片路径或URL, 标注文字)]
+            output_path: 输出文件路径
+            tile_height: 每张图片的高度
+            label_height: 标注区域高度
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            self.ensure_temp_dir()
+            
+            # 先只读取文件头，按宽高比计算每张图片的宽度
+            tiles = []  # (图片来源, 宽度, 标注)
+            for path, label in entries:
+                try:
+                    source = self._read_source(path)
+                    with Image.open(source) as img:
+                        width = max(1, round(img.size[0] * tile_height / img.size[1]))
+                    if hasattr(source, 'seek'):
+                        source.seek(0)
+                    tiles.append((source, width, label))
+                except Exception as e:
+                    logger.error(f"[TYHH] Failed to load image from {path}: {e}")
+            
+            if not tiles:
+                logger.error("[TYHH] No valid images for contact sheet")
+                return False
+            
+            margin = 8
+            canvas_width = sum(width for _, width, _ in tiles) + margin * (len(tiles) + 1)
+            canvas_height = tile_height + label_height + margin * 2
+            canvas = Image.new('RGB', (canvas_width, canvas_height), 'white')
+            draw = ImageDraw.Draw(canvas)
+            try:
+                font = ImageFont.load_default(size=label_height // 2)
+            except TypeError:  # Pillow < 10.1 只有固定大小的默认字体
+                font = ImageFont.load_default()
+            
+            # 逐张缩小解码后粘贴，并在下方居中写标注
+            x = margin
+            for source, width, label in tiles:
+                with Image.open(source) as img:
+                    scaled = self._load_scaled(img, (width, tile_height))
+                if scaled is not None:
+                    canvas.paste(scaled, (x + (width - scaled.size[0]) // 2, margin))
+                    scaled.close()
+                left, top, right, bottom = draw.textbbox((0, 0), label, font=font)
+                draw.text(
+                    (x + (width - (right - left)) // 2, margin + tile_height + (label_height - (bottom - top)) // 2),
+                    label,
+                    fill='black',
+                    font=font
+                )
+                x += width + margin
+            
+            with open(output_path, 'wb') as f:
+                f.write(self.encode_image(canvas))
+            logger.info(f"[TYHH] Successfully saved contact sheet to {output_path}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"[TYHH] Error creating contact sheet: {e}")
+            return False
+
+    def get_blank_canvas(self, resolution):
+        """获取指定分辨率的白色空白画布，首次使用时编码并缓存
+        Args:
+            resolution: 分辨率，如 "1024*1024"
+        Returns:
+            bytes: PNG图片数据
+        """
+        data = self._blank_canvases.get(resolution)
+        if data is None:
+            width, height = map(int, resolution.split('*'))
+            buffer = BytesIO()
+            Image.new('RGB', (width, height), 'white').save(buffer, 'PNG', optimize=True)
+            data = buffer.getvalue()
+            self._blank_canvases[resolution] = data
+            logger.info(f"[TYHH] Cached blank canvas {width}x{height} ({len(data)} bytes)")
+        return data
+
+    def warm_blank_canvases(self, resolutions):
+        """预先缓存多个分辨率的空白画布"""
+        for resolution in resolutions:
+            if resolution not in self._blank_canvases:
+                self.get_blank_canvas(resolution)
+
+    @staticmethod
+    def normalize_upload(data, target_size, quality=90):
+        """上传前规范化图片：缩小到目标分辨率以内，去除元数据并重新编码
+        Args:
+            data: 原始图片数据
+            target_size: 目标分辨率 (宽, 高)
+            quality: JPEG质量
+        Returns:
+            bytes: 不透明图片为JPEG，透明图片为PNG
+        """
+        with Image.open(BytesIO(data)) as img:
+            if img.format == 'JPEG':
+                img.draft('RGB', target_size)
+            # 去除元数据前先按EXIF方向旋转，否则手机竖拍的照片会横过来
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            # 重新生成图片对象，不携带EXIF、ICC等元数据
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        img.thumbnail(target_size, Image.Resampling.LANCZOS)
+
+        output = BytesIO()
+        if has_alpha:
+            img.save(output, 'PNG', optimize=True)
+        else:
+            img.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+    @staticmethod
+    def mime_type(data):
+        """根据文件头判断图片MIME类型和扩展名"""
+        if data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return 'image/png', '.png'
+        if data.startswith(b'\xff\xd8'):
+            return 'image/jpeg', '.jpg'
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return 'image/webp', '.webp'
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return 'image/gif', '.gif'
+        return 'application/octet-stream', ''
+
+    @staticmethod
+    def preprocess_sketch(data, target_size=None, output_mode='L'):
+        """预处理涂鸦图片，将白底彩色线条转换为黑底白线
+        Args:
+            data: 原始图片数据
+            target_size: 目标分辨率 (宽, 高)，先缩小到该尺寸以内再处理
+            output_mode: 输出模式，'L' 为灰度图，'1' 为1位黑白图
+        Returns:
+            bytes: 处理后的PNG图片数据
+        """
+        with Image.open(BytesIO(data)) as img:
+            # JPEG直接按目标尺寸缩小解码
+            if target_size and img.format == 'JPEG':
+                img.draft('RGB', target_size)
+            # 按EXIF方向旋转，与用户看到的涂鸦方向一致
+            img = ImageOps.exif_transpose(img)
+
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        # 先缩小再处理，避免对整张原图做运算
+        if target_size:
+            img.thumbnail(target_size, Image.Resampling.BILINEAR)
+
+        # RGB三通道均值小于240的非透明区域为线条（允许一些容差），置为白色，其他区域为黑色
+        bands = dict(zip('rgba', img.split()))
+        expression = "(r + g + b < 720) & (a > 0)" if has_alpha else "r + g + b < 720"
+        mask = _image_math(expression, **bands).convert('L')
+        processed = mask.point([0] + [255] * 255, '1' if output_mode == '1' else 'L')
+
+        # 编码为PNG
+        output = BytesIO()
+        processed.save(output, 'PNG', optimize=True)
+        return output.getvalue()
+
+    def cleanup_temp_files(self, max_age=None):
+        """清理临时文件
+        Args:
+            max_age: 只清理修改时间早于该秒数的文件，None表示全部清理
+        """
         try:
             if os.path.exists(self.temp_dir):
+                cutoff = time.time() - max_age if max_age else None
                 for file in os.listdir(self.temp_dir):
                     file_path = os.path.join(self.temp_dir, file)
                     try:
                         if os.path.isfile(file_path):
+                            if cutoff and os.path.getmtime(file_path) > cutoff:
+                                continue
                             os.unlink(file_path)
                     except Exception as e:
                         logger.warning(f"[TYHH] Error deleting {file_path}: {e}")
             logger.info("[TYHH] Cleaned up temporary files")
         except Exception as e:
-            logger.error(f"[TYHH] Error cleaning up temporary files: {e}") 
\ No newline at end of file
+            logger.error(f"[TYHH] Error cleaning up temporary files: {e}") 
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""图片处理进程池的子进程入口
+
+子进程以spawn方式启动，按模块名导入这里的函数。插件包的__init__依赖宿主的插件管理器，
+在新进程中无法导入，因此本模块作为顶层模块加载（插件目录由进程池的initializer加入sys.path），
+处理函数也按顶层模块名引用，不经过插件包。
+"""
+import importlib
+import types
+from multiprocessing import shared_memory
+
+
+def task_ref(func):
+    """将处理函数转换为可序列化的引用：(模块名, 限定名, 实例属性)
+    模块名只保留最后一级，如 plugins.tyhh.image_processor -> image_processor；
+    绑定方法额外带上实例的属性，在子进程中重建实例。
+    """
+    owner = getattr(func, "__self__", None)
+    if owner is None or isinstance(owner, types.ModuleType):
+        # 普通函数、静态方法和内置函数（内置函数的__self__是模块）
+        return func.__module__.rsplit('.', 1)[-1], func.__qualname__, None
+    return func.__module__.rsplit('.', 1)[-1], func.__func__.__qualname__, dict(vars(owner))
+
+
+def _resolve(ref):
+    """在子进程中按引用找到处理函数"""
+    module_name, qualname, state = ref
+    target = importlib.import_module(module_name)
+    *owner_path, name = qualname.split('.')
+    for part in owner_path:
+        target = getattr(target, part)
+    if state is not None:
+        # target为类，跳过__init__直接恢复实例属性
+        instance = target.__new__(target)
+        instance.__dict__.update(state)
+        target = instance
+    return getattr(target, name)
+
+
+def run(ref, args):
+    """子进程入口：执行处理函数"""
+    return _resolve(ref)(*args)
+
+
+def run_on_shared(ref, name, size, args):
+    """子进程入口：从共享内存读取输入，处理结果写入新的共享内存
+    输入和输出的共享内存都由主进程释放；子进程与主进程共用resource_tracker，
+    输出在主进程释放前保持跟踪，主进程异常退出时也会被回收。
+    Returns:
+        tuple: (共享内存名称, 数据长度)，处理失败时返回None
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    result = _resolve(ref)(data, *args)
+    if result is None:
+        return None
+
+    out = shared_memory.SharedMemory(create=True, size=max(1, len(result)))
+    out.buf[:len(result)] = result
+    out.close()
+    return out.name, len(result)
@@ -0,0 +1,68 @@
+from collections import deque
+
+
+class KeywordFilter:
+    """屏蔽词过滤器
+
+    将屏蔽词编译为Aho–Corasick自动机，检查一段文本的耗时只与文本长度有关，
+    与屏蔽词数量无关。匹配不区分英文大小写。
+    """
+
+    def __init__(self, keywords=None):
+        self._goto = [{}]     # 状态 -> {字符: 下一状态}
+        self._fail = [0]      # 状态 -> 失败转移状态
+        self._output = [()]   # 状态 -> 在该状态结束的屏蔽词
+        self.keyword_count = 0
+        self._build(keywords or [])
+
+    def _build(self, keywords):
+        """构建trie和失败转移"""
+        for keyword in keywords:
+            if not isinstance(keyword, str):
+                continue
+            keyword = keyword.strip().lower()
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            if keyword not in self._output[state]:
+                self._output[state] += (keyword,)
+                self.keyword_count += 1
+
+        # 按层次遍历计算失败转移，并合并后缀状态的输出
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] += self._output[fail]
+
+    def find(self, text):
+        """查找文本中第一个屏蔽词，未命中时返回None"""
+        if not self.keyword_count or not text:
+            return None
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return output[state][0]
+        return None
+
+    def __len__(self):
+        return self.keyword_count
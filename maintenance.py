@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from common.log import logger
+
+
+class MaintenanceJob:
+    """定时维护任务，按固定间隔或每天固定时间运行"""
+
+    def __init__(self, name, func, interval=None, daily_at=None, jitter=0):
+        """
+        Args:
+            name: 任务名称
+            func: 任务函数，无参数
+            interval: 运行间隔（秒），与daily_at二选一
+            daily_at: 每天运行的时间，格式 HH:MM
+            jitter: 在计划时间后随机延迟的最长时间（秒），避免多个进程同时运行
+        """
+        if not interval and not daily_at:
+            raise ValueError(f"任务 {name} 需要指定 interval 或 daily_at")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.daily_at = daily_at
+        self.jitter = jitter
+        self.next_run = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.run_count = 0
+
+    def schedule(self, now):
+        """计算下一次运行时间"""
+        if self.daily_at:
+            hour, minute = map(int, self.daily_at.split(':'))
+            current = datetime.fromtimestamp(now)
+            target = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if target.timestamp() <= now:
+                target += timedelta(days=1)
+            base = target.timestamp()
+        else:
+            base = now + self.interval
+        self.next_run = base + random.uniform(0, self.jitter)
+
+    def run(self):
+        """运行任务并记录运行时间和耗时，异常只记录不抛出"""
+        start_time = time.time()
+        try:
+            self.func()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"[TYHH] 维护任务 {self.name} 出错: {e}")
+        self.last_run = start_time
+        self.last_duration = time.time() - start_time
+        self.run_count += 1
+        logger.info(f"[TYHH] 维护任务 {self.name} 完成，耗时 {self.last_duration:.2f}s")
+
+    def stats(self):
+        """获取运行状态"""
+        return {
+            "name": self.name,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "next_run": self.next_run,
+            "run_count": self.run_count
+        }
+
+
+class MaintenanceScheduler:
+    """进程内维护任务调度器
+
+    单个后台线程按计划时间依次运行任务，不占用消息处理线程。
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def add_job(self, name, func, interval=None, daily_at=None, jitter=0, run_at_start=False):
+        """添加任务
+        Args:
+            run_at_start: 是否在调度器启动后先运行一次
+        """
+        job = MaintenanceJob(name, func, interval, daily_at, jitter)
+        if run_at_start:
+            job.next_run = time.time() + random.uniform(0, jitter)
+        else:
+            job.schedule(time.time())
+        with self._lock:
+            self._jobs[name] = job
+        self._wakeup.set()
+        return job
+
+    def start(self):
+        """启动调度线程"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="tyhh-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止调度，正在运行的任务会执行完"""
+        self._stopped = True
+        self._wakeup.set()
+
+    def run_now(self, name):
+        """立即运行指定任务，并重新计算下一次运行时间"""
+        job = self._jobs.get(name)
+        if not job:
+            return False
+        job.run()
+        job.schedule(time.time())
+        return True
+
+    def stats(self):
+        """获取各任务的运行状态"""
+        with self._lock:
+            return [job.stats() for job in self._jobs.values()]
+
+    def _run(self):
+        while not self._stopped:
+            now = time.time()
+            with self._lock:
+                jobs = list(self._jobs.values())
+            due = [job for job in jobs if job.next_run <= now]
+            for job in due:
+                if self._stopped:
+                    return
+                job.run()
+                job.schedule(time.time())
+
+            # 等到最近的计划时间，添加任务或停止时提前唤醒
+            next_run = min((job.next_run for job in jobs), default=now + 60)
+            self._wakeup.wait(max(0.0, min(next_run - time.time(), 60)))
+            self._wakeup.clear()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+from common.log import logger
+
+
+class OssPolicyCache:
+    """OSS上传策略缓存
+
+    按taskType缓存getPolicy返回的上传策略，在过期前复用，
+    用户进入等待状态时由预热流程调用ensure提前获取。
+    """
+
+    def __init__(self, fetcher, ttl=300, margin=30):
+        """
+        Args:
+            fetcher: 获取上传策略的函数，签名为 fetcher(task_type) -> dict
+            ttl: 策略未返回过期时间时的默认有效期（秒）
+            margin: 提前失效的时间（秒），避免上传时策略恰好过期
+        """
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.margin = margin
+        self._policies = {}  # task_type -> {"info": 策略, "expire_at": 过期时间, "used": 是否已使用}
+        self._fetching = {}  # task_type -> threading.Event
+        self._no_reuse = set()  # 不允许复用策略的task_type
+        self._lock = threading.Lock()
+
+    def _expire_at(self, policy_info):
+        """计算策略过期时间"""
+        expire = policy_info.get('expire')
+        try:
+            expire = float(expire)
+            # 毫秒时间戳
+            if expire > 1e12:
+                expire /= 1000
+            return expire
+        except (TypeError, ValueError):
+            return time.time() + self.ttl
+
+    def _fresh_entry(self, task_type):
+        """返回未过期的缓存策略"""
+        entry = self._policies.get(task_type)
+        if entry and time.time() < entry["expire_at"] - self.margin:
+            if entry["used"] and task_type in self._no_reuse:
+                return None
+            return entry
+        return None
+
+    def _fetch(self, task_type):
+        """获取新策略并写入缓存，同一taskType同时只有一个请求"""
+        with self._lock:
+            event = self._fetching.get(task_type)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._fetching[task_type] = event
+
+        if not owner:
+            # 已有请求进行中，等待其完成
+            event.wait(30)
+            return
+
+        try:
+            policy_info = self.fetcher(task_type)
+            if policy_info:
+                with self._lock:
+                    self._policies[task_type] = {
+                        "info": policy_info,
+                        "expire_at": self._expire_at(policy_info),
+                        "used": False
+                    }
+        finally:
+            with self._lock:
+                self._fetching.pop(task_type, None)
+            event.set()
+
+    def acquire(self, task_type, file_name):
+        """获取上传策略和本次上传使用的对象key
+        Args:
+            task_type: 任务类型
+            file_name: 上传文件名，用于确定扩展名
+        Returns:
+            tuple: (策略, 对象key)，获取失败时返回 (None, None)
+        """
+        with self._lock:
+            entry = self._fresh_entry(task_type)
+        if entry is None:
+            self._fetch(task_type)
+            with self._lock:
+                entry = self._fresh_entry(task_type)
+            if entry is None:
+                return None, None
+
+        with self._lock:
+            policy_info = entry["info"]
+            if not entry["used"]:
+                # 首次使用直接采用服务端分配的key
+                entry["used"] = True
+                return policy_info, policy_info['key']
+
+        # 复用策略时在同一目录下生成唯一key，避免覆盖其他上传
+        key = policy_info['key']
+        directory = policy_info.get('dir') or (key.rsplit('/', 1)[0] + '/' if '/' in key else '')
+        ext = os.path.splitext(file_name)[1] or os.path.splitext(key)[1]
+        return policy_info, f"{directory}{uuid.uuid4().hex}{ext}"
+
+    def invalidate(self, task_type, reused=False):
+        """使缓存失效
+        Args:
+            reused: 是否为复用策略上传失败，是则该taskType之后不再复用
+        """
+        with self._lock:
+            self._policies.pop(task_type, None)
+            if reused:
+                self._no_reuse.add(task_type)
+                logger.warning(f"[TYHH] 上传策略 {task_type} 不支持复用，改为仅预取")
+
+    def ensure(self, task_type):
+        """确保缓存中有可用策略（不占用），返回策略中的上传地址"""
+        with self._lock:
+            entry = self._fresh_entry(task_type)
+        if entry is None:
+            self._fetch(task_type)
+            with self._lock:
+                entry = self._fresh_entry(task_type)
+        return entry["info"].get('host') if entry else None
+
+
+class OssUrlIndex:
+    """已上传图片索引
+
+    以图片内容哈希索引OSS访问链接，相同图片在链接有效期内直接复用，跳过上传。
+    """
+
+    def __init__(self, ttl=3600, margin=300, capacity=256):
+        """
+        Args:
+            ttl: 链接未携带过期时间时的默认有效期（秒）
+            margin: 提前失效的时间（秒），保证服务端处理任务时链接仍有效
+            capacity: 最多保存的条目数
+        """
+        self.ttl = ttl
+        self.margin = margin
+        self.capacity = capacity
+        self._urls = OrderedDict()  # (task_type, 哈希) -> (链接, 过期时间)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(data):
+        """计算图片内容哈希"""
+        return hashlib.sha256(data).hexdigest()
+
+    def _expire_at(self, url):
+        """从签名链接中解析过期时间
+        V1签名的Expires为过期时间戳；V4签名的x-oss-expires为从签名时间x-oss-date起算的有效秒数。
+        两者都没有时使用默认有效期。
+        """
+        query = parse_qs(urlparse(url).query)
+        try:
+            return float(query["Expires"][0])
+        except (KeyError, IndexError, ValueError):
+            pass
+        try:
+            signed_at = datetime.strptime(query["x-oss-date"][0], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            return signed_at.timestamp() + float(query["x-oss-expires"][0])
+        except (KeyError, IndexError, ValueError):
+            return time.time() + self.ttl
+
+    def get(self, task_type, digest):
+        """查找未过期的访问链接"""
+        key = (task_type, digest)
+        with self._lock:
+            item = self._urls.get(key)
+            if not item:
+                return None
+            url, expire_at = item
+            if time.time() >= expire_at - self.margin:
+                del self._urls[key]
+                return None
+            self._urls.move_to_end(key)
+            return url
+
+    def put(self, task_type, digest, url):
+        """记录上传后的访问链接"""
+        with self._lock:
+            self._urls[(task_type, digest)] = (url, self._expire_at(url))
+            self._urls.move_to_end((task_type, digest))
+            while len(self._urls) > self.capacity:
+                self._urls.popitem(last=False)
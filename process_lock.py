@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from common.log import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """基于文件的跨进程锁，同一线程可重入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def _lock_file(self):
+        """对锁文件加排他锁，阻塞直到成功"""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return
+        while True:
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK重试10秒后仍失败会抛出异常，继续等待
+                continue
+
+    def _unlock_file(self):
+        """释放文件锁"""
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                self._lock_file()
+            self._depth += 1
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+    def try_acquire(self):
+        """尝试加锁，锁已被其他进程持有时不等待
+        Returns:
+            bool: 是否加锁成功
+        """
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+        if self._depth:
+            self._depth += 1
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            self._thread_lock.release()
+            return False
+        self._fd = fd
+        self._depth = 1
+        return True
+
+    def release(self):
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                self._unlock_file()
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class SharedRateLimiter:
+    """多进程共享的请求速率限制
+
+    令牌桶状态保存在磁盘文件中，通过文件锁在多个进程间共享，
+    N个进程合计不超过配置的速率。
+    """
+
+    def __init__(self, state_path, rate_per_minute=30, burst=5):
+        """
+        Args:
+            state_path: 令牌桶状态文件路径
+            rate_per_minute: 每分钟允许的请求数，0表示不限制
+            burst: 允许的突发请求数
+        """
+        self.state_path = state_path
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self._lock = FileLock(state_path + ".lock")
+
+    def _read_state(self, now):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            return float(state["tokens"]), float(state["updated"])
+        except Exception:
+            return float(self.burst), now
+
+    def _write_state(self, tokens, now):
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump({"tokens": tokens, "updated": now}, f)
+
+    def acquire(self):
+        """获取一个请求配额，配额不足时等待"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                tokens, updated = self._read_state(now)
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                if tokens >= 1:
+                    self._write_state(tokens - 1, now)
+                    return
+                self._write_state(tokens, now)
+                wait = (1 - tokens) / self.rate
+            logger.debug(f"[TYHH] 请求配额不足，等待 {wait:.2f}s")
+            time.sleep(wait)
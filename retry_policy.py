@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+import weakref
+from common.log import logger
+
+
+class DeadlineExceeded(Exception):
+    """时间预算已用完或任务已被取消"""
+    pass
+
+
+class Deadline:
+    """端到端时间预算
+
+    在一次请求处理的整个流程（上传、提交、轮询）中传递，
+    每次网络请求的超时不超过剩余预算，预算用完或被取消后流程立即结束。
+    """
+
+    def __init__(self, budget, name=""):
+        """
+        Args:
+            budget: 时间预算（秒）
+            name: 名称，用于日志
+        """
+        self.name = name
+        self.budget = budget
+        self.started_at = time.time()
+        self.expires_at = self.started_at + budget
+        self.cancel_reason = None
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        """剩余时间（秒）"""
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self):
+        return self._cancelled.is_set() or time.time() >= self.expires_at
+
+    def cancel(self, reason="cancelled"):
+        """取消，等待中的sleep会立即返回"""
+        self.cancel_reason = reason
+        self._cancelled.set()
+
+    def check(self):
+        """预算用完或已取消时抛出DeadlineExceeded"""
+        if self._cancelled.is_set():
+            raise DeadlineExceeded(f"{self.name} 已取消: {self.cancel_reason}")
+        if time.time() >= self.expires_at:
+            raise DeadlineExceeded(f"{self.name} 超出时间预算 {self.budget}s")
+
+    def timeout(self, per_attempt):
+        """计算单次请求的超时时间，不超过剩余预算"""
+        self.check()
+        return min(per_attempt, self.remaining())
+
+    def sleep(self, seconds):
+        """在预算内等待，预算不足或被取消时抛出DeadlineExceeded"""
+        self.check()
+        if seconds >= self.remaining():
+            raise DeadlineExceeded(f"{self.name} 剩余时间不足以等待 {seconds:.1f}s")
+        if self._cancelled.wait(seconds):
+            self.check()
+
+
+class RetryPolicy:
+    """重试策略：最大次数、单次超时和带抖动的指数退避"""
+
+    def __init__(self, max_attempts=3, timeout=30, base_delay=1.0, max_delay=30.0, jitter=0.5):
+        """
+        Args:
+            max_attempts: 最大尝试次数
+            timeout: 单次请求超时（秒）
+            base_delay: 首次重试前的等待时间（秒）
+            max_delay: 最长等待时间（秒）
+            jitter: 抖动比例，实际等待时间在 [delay*(1-jitter), delay] 之间
+        """
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def backoff(self, attempt):
+        """第attempt次失败（从0开始）后的等待时间"""
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+    def attempt_timeout(self, deadline=None):
+        """单次请求的超时时间"""
+        return deadline.timeout(self.timeout) if deadline else self.timeout
+
+    def wait(self, attempt, deadline=None):
+        """失败后按退避时间等待"""
+        delay = self.backoff(attempt)
+        if deadline:
+            deadline.sleep(delay)
+        else:
+            time.sleep(delay)
+
+
+class Watchdog:
+    """监控进行中的任务，超出时间预算后仍未结束的任务将被取消"""
+
+    def __init__(self, interval=5, grace=30):
+        """
+        Args:
+            interval: 检查间隔（秒）
+            grace: 超出预算多久后取消（秒）
+        """
+        self.interval = interval
+        self.grace = grace
+        self._deadlines = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, deadline):
+        """开始监控，任务结束后Deadline被回收即自动停止监控"""
+        with self._lock:
+            self._deadlines.add(deadline)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return deadline
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                deadlines = list(self._deadlines)
+            for deadline in deadlines:
+                if not deadline._cancelled.is_set() and now > deadline.expires_at + self.grace:
+                    logger.warning(f"[TYHH] 任务 {deadline.name} 超出时间预算 {deadline.budget}s 仍未结束，已取消")
+                    deadline.cancel("watchdog")
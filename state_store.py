@@ -0,0 +1,336 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from common.log import logger
+
+
+class StateStore:
+    """会话状态存储
+
+    用法与dict相同，每个条目有过期时间，总数超过容量时淘汰最久未使用的条目。
+    条目按最近使用顺序排列，读写都会刷新过期时间，因此队首总是最早过期的条目，
+    清理过期条目时只需从队首检查，均摊O(1)。
+    """
+
+    def __init__(self, name, ttl=600, capacity=1000):
+        """
+        Args:
+            name: 存储名称，用于日志和统计
+            ttl: 条目有效期（秒）
+            capacity: 最多保存的条目数
+        """
+        self.name = name
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()  # key -> [value, 过期时间]
+        self._lock = threading.RLock()
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    def _purge(self, now):
+        """从队首清理已过期的条目"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[1] > now:
+                break
+            self._entries.popitem(last=False)
+            self.expired_count += 1
+
+    def _get_entry(self, key, now):
+        """获取未过期的条目并刷新过期时间"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            self.expired_count += 1
+            return None
+        entry[1] = now + self.ttl
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, value):
+        """写入条目"""
+        with self._lock:
+            now = time.time()
+            self._purge(now)
+            self._entries[key] = [value, now + self.ttl]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.evicted_count += 1
+                logger.warning(f"[TYHH] {self.name} 超出容量，淘汰: {evicted_key}")
+
+    def get(self, key, default=None):
+        """读取条目，不存在或已过期时返回default"""
+        with self._lock:
+            entry = self._get_entry(key, time.time())
+            return default if entry is None else entry[0]
+
+    def pop(self, key, *default):
+        """删除并返回条目"""
+        with self._lock:
+            entry = self._get_entry(key, time.time())
+            if entry is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            del self._entries[key]
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_entry(key, time.time()) is not None
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._get_entry(key, time.time())
+            if entry is None:
+                raise KeyError(key)
+            return entry[0]
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __len__(self):
+        with self._lock:
+            self._purge(time.time())
+            return len(self._entries)
+
+    def stats(self):
+        """获取统计信息"""
+        return {
+            "name": self.name,
+            "live": len(self),
+            "capacity": self.capacity,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count
+        }
+
+    def claim(self, key):
+        """原子地取出并删除条目，不存在时返回None"""
+        return self.pop(key, None)
+
+    def items(self):
+        """获取所有未过期条目的(键, 值)列表，不刷新过期时间"""
+        with self._lock:
+            self._purge(time.time())
+            return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def purge_expired(self):
+        """清理所有已过期的条目
+        Returns:
+            int: 清理的条目数
+        """
+        with self._lock:
+            count = len(self._entries)
+            self._purge(time.time())
+            return count - len(self._entries)
+
+
+class SqliteStateStore:
+    """基于SQLite文件的会话状态存储
+
+    接口与StateStore相同，多个机器人进程共享同一个数据库文件，
+    claim在单个事务中完成读取和删除，保证同一条目只会被一个进程取出。
+    条目值需可JSON序列化。
+    """
+
+    def __init__(self, name, db_path, ttl=600, capacity=1000):
+        """
+        Args:
+            name: 存储名称，同一数据库中不同存储以此区分
+            db_path: 数据库文件路径
+            ttl: 条目有效期（秒）
+            capacity: 最多保存的条目数
+        """
+        self.name = name
+        self.db_path = db_path
+        self.ttl = ttl
+        self.capacity = capacity
+        self.expired_count = 0
+        self.evicted_count = 0
+        self._init_db()
+
+    def _connect(self):
+        """创建数据库连接，自动提交模式，事务手动控制"""
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA busy_timeout = 10000')
+        return conn
+
+    def _init_db(self):
+        """初始化数据库"""
+        try:
+            conn = self._connect()
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS states (
+                    store TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expire_at REAL NOT NULL,
+                    PRIMARY KEY (store, key)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_states_expire ON states (store, expire_at)')
+            conn.close()
+        except Exception as e:
+            logger.error(f"[TYHH] Failed to initialize state database: {e}")
+            raise e
+
+    def _take(self, key, delete):
+        """在单个事务中读取未过期的条目，刷新过期时间或删除
+        Returns:
+            tuple: (是否存在, 值)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT value, expire_at FROM states WHERE store = ? AND key = ?',
+                (self.name, str(key))
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return False, None
+            if row[1] <= now:
+                conn.execute('DELETE FROM states WHERE store = ? AND key = ?', (self.name, str(key)))
+                conn.execute('COMMIT')
+                self.expired_count += 1
+                return False, None
+            if delete:
+                conn.execute('DELETE FROM states WHERE store = ? AND key = ?', (self.name, str(key)))
+            else:
+                conn.execute(
+                    'UPDATE states SET expire_at = ? WHERE store = ? AND key = ?',
+                    (now + self.ttl, self.name, str(key))
+                )
+            conn.execute('COMMIT')
+            return True, json.loads(row[0])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def set(self, key, value):
+        """写入条目"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute('DELETE FROM states WHERE store = ? AND expire_at <= ?', (self.name, now))
+            self.expired_count += cursor.rowcount
+            conn.execute(
+                'INSERT OR REPLACE INTO states (store, key, value, expire_at) VALUES (?, ?, ?, ?)',
+                (self.name, str(key), json.dumps(value, ensure_ascii=False), now + self.ttl)
+            )
+            # 超出容量时淘汰最早过期（即最久未使用）的条目
+            cursor = conn.execute('''
+                DELETE FROM states WHERE store = ? AND key IN (
+                    SELECT key FROM states WHERE store = ?
+                    ORDER BY expire_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.name, self.name, self.capacity))
+            if cursor.rowcount > 0:
+                self.evicted_count += cursor.rowcount
+                logger.warning(f"[TYHH] {self.name} 超出容量，淘汰 {cursor.rowcount} 条")
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def get(self, key, default=None):
+        """读取条目，不存在或已过期时返回default"""
+        found, value = self._take(key, delete=False)
+        return value if found else default
+
+    def pop(self, key, *default):
+        """删除并返回条目"""
+        found, value = self._take(key, delete=True)
+        if found:
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def claim(self, key):
+        """原子地取出并删除条目，不存在时返回None"""
+        return self.pop(key, None)
+
+    def __contains__(self, key):
+        return self._take(key, delete=False)[0]
+
+    def __getitem__(self, key):
+        found, value = self._take(key, delete=False)
+        if not found:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def items(self):
+        """获取所有未过期条目的(键, 值)列表，不刷新过期时间"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT key, value FROM states WHERE store = ? AND expire_at > ?',
+                (self.name, time.time())
+            ).fetchall()
+            return [(key, json.loads(value)) for key, value in rows]
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        """清理所有已过期的条目
+        Returns:
+            int: 清理的条目数
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                'DELETE FROM states WHERE store = ? AND expire_at <= ?',
+                (self.name, time.time())
+            )
+            self.expired_count += cursor.rowcount
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT COUNT(*) FROM states WHERE store = ? AND expire_at > ?',
+                (self.name, time.time())
+            ).fetchone()
+            return row[0]
+        finally:
+            conn.close()
+
+    def stats(self):
+        """获取统计信息（过期和淘汰计数仅为本进程）"""
+        return {
+            "name": self.name,
+            "live": len(self),
+            "capacity": self.capacity,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count
+        }
+
+
+def create_state_store(name, ttl=600, capacity=1000, backend="memory", db_path=None):
+    """按配置创建会话状态存储
+    Args:
+        backend: memory 为进程内存储，sqlite 为多进程共享存储
+        db_path: sqlite后端的数据库文件路径
+    """
+    if backend == "sqlite":
+        return SqliteStateStore(name, db_path, ttl, capacity)
+    return StateStore(name, ttl, capacity)
@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+import uuid
+from common.log import logger
+
+
+class _NoLock:
+    """单进程使用时的空锁"""
+
+    def acquire(self):
+        pass
+
+    def try_acquire(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class TaskJournal:
+    """进行中任务的追加式日志
+
+    每提交一个任务追加一条submit记录，任务结束追加一条done记录，
+    每条记录写入后立即落盘。重启后未结束的任务可继续轮询结果。
+    done记录累积到一定数量时压缩日志，只保留未结束的任务。
+
+    多进程部署时各进程共用同一个路径前缀，每个进程写入 <前缀>.<实例ID> 并在运行期间
+    持有对应的 .lock 文件锁。启动时接管锁已释放（进程已退出）的日志，
+    每份日志只会被一个进程接管，重启前的任务不会被多个进程重复发送。
+    """
+
+    def __init__(self, path, checkpoint_every=50, lock_factory=None):
+        """
+        Args:
+            path: 日志文件路径前缀
+            checkpoint_every: 累积多少条done记录后压缩日志
+            lock_factory: 创建跨进程文件锁的函数，参数为锁文件路径（如FileLock），为None时不加锁，只适用于单进程
+        """
+        self.base_path = path
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.path = f"{path}.{self.instance_id}"
+        self.checkpoint_every = checkpoint_every
+        self._pending = {}  # task_id -> 提交记录
+        self._done_since_checkpoint = 0
+        self._lock = threading.Lock()
+        self._lock_factory = lock_factory or (lambda path: _NoLock())
+        self._owner_lock = self._lock_factory(self.path + ".lock")
+        self._owner_lock.acquire()
+        self._adopt_orphans()
+
+    @staticmethod
+    def _read(path):
+        """读取一份日志，返回其中未结束的任务 task_id -> 提交记录"""
+        pending = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下不完整的最后一行
+                    logger.warning("[TYHH] 任务日志中存在不完整的记录，已跳过")
+                    continue
+                if record.get("op") == "submit":
+                    pending[record["task_id"]] = record
+                elif record.get("op") == "done":
+                    pending.pop(record["task_id"], None)
+        return pending
+
+    def _orphan_paths(self):
+        """列出其他实例的日志路径（包括旧版本不带实例ID的日志）"""
+        directory, prefix = os.path.split(self.base_path)
+        paths = {self.base_path}
+        for name in os.listdir(directory or "."):
+            if not name.startswith(prefix + ".") or name.endswith(".tmp"):
+                continue
+            if name.endswith(".lock"):
+                name = name[:-len(".lock")]
+            paths.add(os.path.join(directory, name))
+        paths.discard(self.path)
+        return sorted(paths)
+
+    def _adopt_orphans(self):
+        """接管已退出进程留下的日志：合并其中未结束的任务后删除原日志"""
+        adopted = []
+        try:
+            for path in self._orphan_paths():
+                lock = self._lock_factory(path + ".lock")
+                if not lock.try_acquire():
+                    continue  # 所属进程仍在运行
+                adopted.append((path, lock))
+                if os.path.exists(path):
+                    records = self._read(path)
+                    self._pending.update(records)
+                    logger.info(f"[TYHH] 接管已退出进程的任务日志 {os.path.basename(path)}，未结束任务: {len(records)}")
+            if adopted:
+                # 先将接管的任务写入自己的日志，再删除原日志
+                self._checkpoint()
+                for path, _ in adopted:
+                    if os.path.exists(path):
+                        os.remove(path)
+            logger.info(f"[TYHH] 任务日志加载完成，未结束任务: {len(self._pending)}")
+        except Exception as e:
+            logger.error(f"[TYHH] 读取任务日志失败: {e}")
+        finally:
+            for path, lock in adopted:
+                for leftover in (path + ".tmp", path + ".lock"):
+                    try:
+                        os.remove(leftover)
+                    except OSError:
+                        pass
+                lock.release()
+
+    def _append(self, record):
+        """追加一条记录并落盘"""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_submit(self, task_id, user_id, context, params):
+        """记录已提交的任务
+        Args:
+            task_id: 任务ID
+            user_id: 用户ID
+            context: 发送结果所需的会话信息
+            params: 任务参数
+        """
+        record = {
+            "op": "submit",
+            "task_id": task_id,
+            "user_id": user_id,
+            "context": context,
+            "params": params,
+            "time": int(time.time())
+        }
+        with self._lock:
+            try:
+                self._append(record)
+                self._pending[task_id] = record
+            except Exception as e:
+                logger.error(f"[TYHH] 写入任务日志失败: {e}")
+
+    def record_done(self, task_id):
+        """记录任务已结束"""
+        with self._lock:
+            if self._pending.pop(task_id, None) is None:
+                return
+            try:
+                self._append({"op": "done", "task_id": task_id, "time": int(time.time())})
+                self._done_since_checkpoint += 1
+                if self._done_since_checkpoint >= self.checkpoint_every:
+                    self._checkpoint()
+            except Exception as e:
+                logger.error(f"[TYHH] 写入任务日志失败: {e}")
+
+    def pending(self):
+        """获取未结束的任务记录"""
+        with self._lock:
+            return list(self._pending.values())
+
+    def _checkpoint(self):
+        """将日志压缩为只包含未结束任务，写入临时文件后原子替换"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._done_since_checkpoint = 0
+
+    def checkpoint(self):
+        """压缩日志"""
+        with self._lock:
+            try:
+                self._checkpoint()
+            except Exception as e:
+                logger.error(f"[TYHH] 压缩任务日志失败: {e}")
+
+    def close(self):
+        """退出时压缩日志并释放文件锁，未结束的任务由下次启动的进程接管；没有未结束的任务时删除日志"""
+        with self._lock:
+            try:
+                if self._pending:
+                    self._checkpoint()
+                elif os.path.exists(self.path):
+                    os.remove(self.path)
+                if os.path.exists(self.path + ".lock"):
+                    os.remove(self.path + ".lock")
+            except Exception as e:
+                logger.error(f"[TYHH] 关闭任务日志失败: {e}")
+            finally:
+                self._owner_lock.release()
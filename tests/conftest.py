@@ -0,0 +1,44 @@
+import importlib
+import os
+import sys
+import types
+
+import pytest
+
+# 插件模块直接按顶层模块导入，common.log 等依赖由宿主项目根目录提供
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(TESTS_DIR)
+sys.path[:0] = [PLUGIN_DIR, os.path.dirname(os.path.dirname(PLUGIN_DIR))]
+
+# 不在宿主项目中时使用 tests/stubs 下的替身；放在 sys.path 中，子进程同样可以导入
+try:
+    import common.log  # noqa: F401
+except ImportError:
+    sys.path.append(os.path.join(TESTS_DIR, "stubs"))
+
+
+def _package_name(directory):
+    """插件目录作为包时的模块名，如宿主项目中的 plugins.tyhh"""
+    names = []
+    while os.path.isfile(os.path.join(directory, "__init__.py")):
+        names.insert(0, os.path.basename(directory))
+        directory = os.path.dirname(directory)
+    return ".".join(names)
+
+
+# pytest会导入测试所在包的__init__，插件的__init__需要宿主的插件管理器，
+# 这里预先登记一个不执行__init__的空包，包内模块仍可按 <包名>.<模块> 导入
+PACKAGE_NAME = _package_name(PLUGIN_DIR)
+if PACKAGE_NAME and PACKAGE_NAME not in sys.modules:
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__file__ = os.path.join(PLUGIN_DIR, "__init__.py")
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules[PACKAGE_NAME] = package
+
+
+@pytest.fixture
+def package_module():
+    """按插件包内的模块名导入模块，与宿主中的导入方式一致"""
+    def load(name):
+        return importlib.import_module(f"{PACKAGE_NAME}.{name}" if PACKAGE_NAME else name)
+    return load
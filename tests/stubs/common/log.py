@@ -0,0 +1,5 @@
+"""宿主项目 common.log 的替身，仅在插件目录下单独运行测试时使用"""
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("tyhh")
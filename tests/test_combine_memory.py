@@ -0,0 +1,88 @@
+"""合并图片的内存峰值测试
+
+tracemalloc 只能跟踪Python堆（下载数据、编码结果等），Pillow的像素缓冲区由C代码分配，
+因此像素内存通过子进程的峰值RSS（ru_maxrss）增量衡量。
+"""
+import os
+import subprocess
+import sys
+import textwrap
+import tracemalloc
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+resource = pytest.importorskip("resource")
+
+from image_processor import ImageProcessor
+
+# 放大后的原图为2048x2048，单张RGB解码约16MB
+SOURCE_SIZE = (2048, 2048)
+HEAP_PEAK_LIMIT = 6 * 1024 * 1024
+RSS_PEAK_LIMIT_MB = 40
+
+RSS_SCRIPT = textwrap.dedent("""
+    import resource
+    import sys
+    from image_processor import ImageProcessor
+
+    paths, output_path, max_decode_mb = sys.argv[1:5], sys.argv[5], int(sys.argv[6])
+    processor = ImageProcessor(
+        sys.argv[7],
+        streaming=True,
+        max_decode_bytes=max_decode_mb * 1024 * 1024,
+        max_output_bytes=500 * 1024
+    )
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert processor.combine_images(paths, output_path)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print((after - before) / 1024)
+""")
+
+
+def make_sources(directory, size, ext):
+    paths = []
+    for i in range(4):
+        path = os.path.join(directory, f"source_{i}{ext}")
+        Image.effect_noise(size, 20 + i * 5).convert('RGB').save(path)
+        paths.append(path)
+    return paths
+
+
+def rss_growth_mb(tmp_path, paths, max_decode_mb):
+    """在新的子进程中合并一次，返回峰值RSS增量（MB）"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run(
+        [sys.executable, "-c", RSS_SCRIPT, *paths, str(tmp_path / "merged.jpg"), str(max_decode_mb), str(tmp_path)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def test_streaming_heap_peak_per_grid(tmp_path):
+    paths = make_sources(tmp_path, SOURCE_SIZE, ".png")
+    processor = ImageProcessor(str(tmp_path), streaming=True, max_decode_bytes=64 * 1024 * 1024,
+                               max_output_bytes=500 * 1024)
+
+    tracemalloc.start()
+    try:
+        assert processor.combine_images(paths, str(tmp_path / "merged.jpg"))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < HEAP_PEAK_LIMIT
+
+
+@pytest.mark.parametrize("ext", [".png", ".jpg"])
+def test_streaming_rss_peak_per_grid(tmp_path, ext):
+    paths = make_sources(tmp_path, SOURCE_SIZE, ext)
+    assert rss_growth_mb(tmp_path, paths, 64) < RSS_PEAK_LIMIT_MB
+
+
+def test_decode_ceiling_bounds_large_jpeg(tmp_path):
+    # 4096x4096的JPEG完整解码需64MB，内存上限为8MB时应以缩小的尺寸解码
+    paths = make_sources(tmp_path, (4096, 4096), ".jpg")
+    assert rss_growth_mb(tmp_path, paths, 8) < RSS_PEAK_LIMIT_MB
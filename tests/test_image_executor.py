@@ -0,0 +1,49 @@
+"""图片处理进程池测试：处理函数须在子进程中执行，而不是进程池出错后回退到当前线程"""
+import os
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_jpeg(size):
+    buffer = BytesIO()
+    Image.effect_noise(size, 20).convert('RGB').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def executor(package_module):
+    executor = package_module("image_executor").ImageExecutor(max_workers=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_runs_in_worker_process(executor):
+    assert executor.run(os.getpid, timeout=60) != os.getpid()
+
+
+def test_package_functions_run_in_pool(executor, package_module, tmp_path):
+    # 处理函数按插件包内的模块名引用，子进程无法导入插件包的__init__
+    ImageProcessor = package_module("image_processor").ImageProcessor
+    data = make_jpeg((2000, 1000))
+    executor.warm_up()
+    pool = executor._pool
+
+    normalized = executor.run_with_buffer(ImageProcessor.normalize_upload, data, (1024, 1024), timeout=60)
+    assert Image.open(BytesIO(normalized)).size == (1024, 512)
+
+    processor = ImageProcessor(str(tmp_path))
+    reencoded = executor.run_with_buffer(processor.reencode, data, timeout=60)
+    assert Image.open(BytesIO(reencoded)).size == (2000, 1000)
+
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"source_{i}.jpg"
+        path.write_bytes(data)
+        paths.append(str(path))
+    assert executor.run(processor.combine_images, paths, str(tmp_path / "merged.jpg"), timeout=60)
+
+    # 子进程出错时进程池会被重建并回退到当前线程执行
+    assert executor._pool is pool
@@ -0,0 +1,42 @@
+"""已上传图片索引测试：按签名链接中的过期时间复用链接"""
+import time
+from datetime import datetime, timezone
+
+from oss_cache import OssUrlIndex
+
+URL = "https://bucket.oss-cn-beijing.aliyuncs.com/upload/a.png"
+
+
+def v4_url(signed_at, expires):
+    date = datetime.fromtimestamp(signed_at, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return (f"{URL}?x-oss-credential=ak%2F20240101%2Fcn-beijing%2Foss%2Faliyun_v4_request"
+            f"&x-oss-date={date}&x-oss-expires={expires}&x-oss-signature-version=OSS4-HMAC-SHA256"
+            f"&x-oss-signature=abc")
+
+
+def test_v4_expiry_counts_from_signing_time():
+    index = OssUrlIndex(ttl=60, margin=300)
+    url = v4_url(time.time() - 600, 3600)
+    index.put("sketch", "digest", url)
+    assert index.get("sketch", "digest") == url
+
+    expired = v4_url(time.time() - 3500, 3600)
+    index.put("sketch", "old", expired)
+    assert index.get("sketch", "old") is None
+
+
+def test_v1_expires_is_absolute():
+    index = OssUrlIndex(ttl=60, margin=300)
+    url = f"{URL}?OSSAccessKeyId=ak&Expires={int(time.time()) + 3600}&Signature=abc"
+    index.put("sketch", "digest", url)
+    assert index._urls[("sketch", "digest")][1] > time.time() + 3500
+
+
+def test_unsigned_url_uses_default_ttl():
+    index = OssUrlIndex(ttl=3600, margin=300)
+    index.put("sketch", "digest", URL)
+    assert index.get("sketch", "digest") == URL
+
+    short = OssUrlIndex(ttl=60, margin=300)
+    short.put("sketch", "digest", URL)
+    assert short.get("sketch", "digest") is None
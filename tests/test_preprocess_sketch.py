@@ -0,0 +1,48 @@
+"""手绘预处理测试：线条判定与原来的规则一致（非透明且RGB三通道均值小于240）"""
+import random
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from image_processor import ImageProcessor
+
+
+def expected(pixel):
+    r, g, b, a = pixel
+    return 255 if a > 0 and (r + g + b) / 3 < 240 else 0
+
+
+def make_pixels(size, alpha):
+    rng = random.Random(size)
+    pixels = [
+        (255, 255, 150, 255),  # 浅黄色线条
+        (240, 240, 240, 255),  # 均值恰好为240，视为背景
+        (240, 240, 239, 255),
+        (0, 0, 0, 0),  # 透明区域
+        (0, 0, 0, 1),
+        (255, 255, 255, 255),
+    ]
+    while len(pixels) < size * size:
+        value = rng.randrange(200, 256)
+        pixels.append((value, rng.randrange(200, 256), rng.randrange(200, 256), rng.choice(alpha)))
+    return pixels
+
+
+@pytest.mark.parametrize("output_mode", ["L", "1"])
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+def test_stroke_rule_matches_rgb_mean(mode, output_mode):
+    size = 64
+    pixels = make_pixels(size, [0, 128, 255] if mode == "RGBA" else [255])
+    img = Image.new("RGBA", (size, size))
+    img.putdata(pixels)
+    img = img.convert(mode)
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+
+    result = Image.open(BytesIO(ImageProcessor.preprocess_sketch(buffer.getvalue(), None, output_mode)))
+    assert result.mode == output_mode
+    values = [255 if value else 0 for value in result.convert("L").tobytes()]
+    rgba = img.convert("RGBA").tobytes()
+    assert values == [expected(rgba[i:i + 4]) for i in range(0, len(rgba), 4)]
@@ -0,0 +1,58 @@
+"""任务日志测试：多个进程共用路径前缀时，每份日志只被一个进程接管"""
+import os
+
+from process_lock import FileLock
+from task_journal import TaskJournal
+
+
+def submit(journal, task_id):
+    journal.record_submit(task_id, "user", {"receiver": "r"}, {"prompt": task_id})
+
+
+def test_running_instances_do_not_share_records(tmp_path):
+    base = str(tmp_path / "tasks.journal")
+    first = TaskJournal(base, lock_factory=FileLock)
+    second = TaskJournal(base, lock_factory=FileLock)
+    submit(first, "a")
+    submit(second, "b")
+    first.checkpoint()
+
+    # 压缩日志只改写自己的文件，另一个实例的记录仍在
+    third = TaskJournal(base, lock_factory=FileLock)
+    assert third.pending() == []
+    second.close()
+    assert list(TaskJournal._read(first.path)) == ["a"]
+    assert list(TaskJournal._read(second.path)) == ["b"]
+    first.close()
+    third.close()
+
+
+def test_exited_instance_is_adopted_once(tmp_path):
+    base = str(tmp_path / "tasks.journal")
+    old = TaskJournal(base, lock_factory=FileLock)
+    submit(old, "a")
+    submit(old, "b")
+    old.record_done("b")
+    old.close()
+
+    # 同时启动的两个实例只有一个接管退出进程的任务
+    first = TaskJournal(base, lock_factory=FileLock)
+    second = TaskJournal(base, lock_factory=FileLock)
+    assert [record["task_id"] for record in first.pending()] == ["a"]
+    assert second.pending() == []
+    assert not os.path.exists(old.path)
+
+    first.record_done("a")
+    first.close()
+    second.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_legacy_journal_is_adopted(tmp_path):
+    base = str(tmp_path / "tasks.journal")
+    with open(base, "w", encoding="utf-8") as f:
+        f.write('{"op": "submit", "task_id": "a", "params": {}}\n')
+    journal = TaskJournal(base, lock_factory=FileLock)
+    assert [record["task_id"] for record in journal.pending()] == ["a"]
+    assert not os.path.exists(base)
+    journal.close()
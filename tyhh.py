@@ -1,4 +1,3 @@
-import json
 import logging
 import requests
 import os
@@ -7,12 +6,12 @@ from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from plugins import Plugin, Event, EventAction, EventContext, register
 from common.log import logger
-from PIL import Image
 from io import BytesIO
 import threading
 import uuid
+import atexit
+from http.cookiejar import DefaultCookiePolicy
 from urllib.parse import unquote
-import numpy as np
 
 @register(
     name="TYHH",
@@ -23,8 +22,29 @@ import numpy as np
 class TongyiDrawingPlugin(Plugin):
     def __init__(self):
         super().__init__()
+        init_start = time.time()
         self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
-        self.config = self._load_config()
+        self.router = self._build_router()
+        from .command_parser import CommandParser
+        self.command_parser = CommandParser()
+        
+        # 配置文件：原子写入、合并保存、修改后自动重新加载
+        # 多进程共享配置时，凭证刷新和保存使用文件锁
+        from .config_store import ConfigStore
+        from .process_lock import FileLock
+        config_path = os.path.join(os.path.dirname(__file__), "config.json")
+        self.config_lock = FileLock(config_path + ".lock")
+        self.config_store = ConfigStore(
+            config_path,
+            self._default_config(),
+            lock=self.config_lock,
+            before_write=self._adopt_shared_credentials,
+            on_reload=self._on_config_reloaded
+        )
+        self.config = self.config_store.data
+        
+        # 本地屏蔽词，提交前检查提示词
+        self.keyword_filter = self._build_keyword_filter()
         
         # 初始化存储路径
         storage_dir = os.path.join(os.path.dirname(__file__), "storage")
@@ -35,20 +55,72 @@ class TongyiDrawingPlugin(Plugin):
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
             
-        # 初始化图片处理器和存储器
-        from .image_processor import ImageProcessor
+        # 初始化存储器，图片处理器（依赖PIL）在首次使用时创建
         from .image_storage import ImageStorage
-        self.image_processor = ImageProcessor(temp_dir)
+        from .image_executor import ImageExecutor
+        from .oss_cache import OssPolicyCache, OssUrlIndex
+        from .state_store import create_state_store
+        from .process_lock import SharedRateLimiter
+        from .task_journal import TaskJournal
+        from .retry_policy import RetryPolicy, Watchdog
+        from .maintenance import MaintenanceScheduler
+        self._temp_dir = temp_dir
+        self._image_processor = None
+        self._image_processor_lock = threading.Lock()
         self.image_storage = ImageStorage(os.path.join(storage_dir, "images.db"))
         
+        # 重试策略和时间预算：每次请求都有超时，整个流程共享一个时间预算
+        self.request_timeout = self.config.get("request_timeout", 30)
+        self.image_timeout = self.config.get("image_timeout", 60)
+        self.poll_interval = self.config.get("poll_interval", 10)
+        self.task_deadline = self.config.get("task_deadline", 360)
+        self.submit_retry = RetryPolicy(max_attempts=3, timeout=self.request_timeout, base_delay=2, max_delay=10)
+        self.poll_retry = RetryPolicy(max_attempts=5, timeout=self.request_timeout, base_delay=2, max_delay=20)
+        self.watchdog = Watchdog()
+        
+        # 已提交任务日志，重启后继续轮询未结束的任务
+        self.task_journal = TaskJournal(
+            self.config.get("task_journal_path") or os.path.join(storage_dir, "tasks.journal"),
+            lock_factory=FileLock
+        )
+        # 在开始处理消息前取出重启前未结束的任务，之后新提交的任务由各自的处理流程轮询
+        self._pending_at_start = self.task_journal.pending()
+        
+        # 多进程共享请求速率配额
+        self.rate_limiter = SharedRateLimiter(
+            os.path.join(storage_dir, "rate_limit.json"),
+            rate_per_minute=self.config.get("rate_limit_per_minute", 60),
+            burst=self.config.get("rate_limit_burst", 10)
+        )
+        self.image_executor = ImageExecutor(self.config.get("image_workers", 2))
+        self.oss_policy_cache = OssPolicyCache(self._fetch_oss_policy, ttl=self.config.get("oss_policy_ttl", 300))
+        self.oss_url_index = OssUrlIndex(ttl=self.config.get("oss_url_ttl", 3600))
+        
+        # 预热状态：正在预热的任务类型和最近一次预热完成时间，避免重复预热
+        self._warm_up_lock = threading.Lock()
+        self._warm_up_running = set()
+        self._warm_up_done = {}  # 任务类型 -> 完成时间
+        
+        # 会话状态有效期、容量和存储后端（sqlite后端可供多个进程共享）
+        state_options = {
+            "ttl": self.config.get("state_ttl", 600),
+            "capacity": self.config.get("state_capacity", 1000),
+            "backend": self.config.get("state_backend", "memory"),
+            "db_path": self.config.get("state_db_path") or os.path.join(storage_dir, "state.db")
+        }
+        
         # 添加登录状态标志
         self.need_login = False
-        self.login_waiting_users = {}
-        self.sms_tokens = {}
+        self.login_waiting_users = create_state_store("login_waiting_users", **state_options)
+        self.sms_tokens = create_state_store("sms_tokens", **state_options)
+        
+        # 复用连接的HTTP会话，不保存响应中的cookie，cookie统一由配置管理
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
         
         # Token相关
         self.last_token_check = 0
-        self.xsrf_token = ""
+        self.xsrf_token = self.config.get("xsrf_token", "")
         self.token = ""
         
         # 签到相关
@@ -56,56 +128,342 @@ class TongyiDrawingPlugin(Plugin):
         self.current_credits = 0
         
         # 新增: 手绘和上传状态跟踪
-        self.sketch_waiting_users = {}  # 用户ID -> {"prompt": 提示词}
-        self.upload_waiting_users = {}  # 用户ID -> {"prompt": 提示词}
+        self.sketch_waiting_users = create_state_store("sketch_waiting_users", **state_options)  # 用户ID -> {"prompt": 提示词}
+        self.upload_waiting_users = create_state_store("upload_waiting_users", **state_options)  # 用户ID -> {"prompt": 提示词}
+        
+        # 被服务端拒绝的提示词，有效期内相同的提示词直接拒绝
+        self.rejected_prompt_ttl = self.config.get("rejected_prompt_ttl", 86400)
+        self.rejected_prompts = create_state_store(
+            "rejected_prompts",
+            ttl=self.rejected_prompt_ttl,
+            capacity=self.config.get("rejected_prompt_capacity", 1000),
+            backend=state_options["backend"],
+            db_path=state_options["db_path"]
+        )  # 任务类型:规范化提示词 -> {"prompt", "task_type", "reason", "hits", "rejected_at", "expire_at"}
         
         # 检查是否需要登录
         if not self.config.get("cookie", ""):
             logger.info("[TYHH] 未检测到cookie配置，需要登录")
             self.need_login = True
         else:
-            # 自动签到
-            self._auto_sign_in()
+            # 签到、积分查询和未完成任务的恢复都需要网络请求，放到后台执行，不阻塞启动
+            threading.Thread(target=self._background_start, name="tyhh-startup", daemon=True).start()
         
-        logger.info("[TYHH] plugin initialized")
+        # 后台维护任务：每日签到、积分刷新、过期数据和临时文件清理
+        self.scheduler = MaintenanceScheduler()
+        self._add_maintenance_jobs()
+        self.scheduler.start()
+        
+        # 退出时保存任务日志并关闭进程池
+        atexit.register(self._on_shutdown)
+        
+        logger.info(f"[TYHH] plugin initialized，耗时 {(time.time() - init_start) * 1000:.1f}ms")
 
-    def _load_config(self):
-        """加载配置文件"""
-        config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    @property
+    def image_processor(self):
+        """图片处理器，首次使用时才加载PIL并创建"""
+        if self._image_processor is None:
+            with self._image_processor_lock:
+                if self._image_processor is None:
+                    from .image_processor import ImageProcessor
+                    max_decode_mb = self.config.get("image_max_decode_mb", 64)
+                    output_max_kb = self.config.get("output_max_kb", 500)
+                    self._image_processor = ImageProcessor(
+                        self._temp_dir,
+                        resample=self.config.get("image_resample", "lanczos"),
+                        streaming=self.config.get("image_streaming", True),
+                        max_decode_bytes=max_decode_mb * 1024 * 1024 if max_decode_mb else None,
+                        output_format=self.config.get("output_format", "jpeg"),
+                        max_output_bytes=output_max_kb * 1024 if output_max_kb else None,
+                        subsampling=self.config.get("output_subsampling", "4:2:0")
+                    )
+        return self._image_processor
+
+    def _add_maintenance_jobs(self):
+        """注册后台维护任务"""
+        jitter = self.config.get("maintenance_jitter", 300)
+        self.scheduler.add_job("sign_in", self._scheduled_sign_in,
+                               daily_at=self.config.get("sign_in_time", "00:05"), jitter=jitter)
+        self.scheduler.add_job("credit_refresh", self._scheduled_credit_refresh,
+                               interval=self.config.get("credit_refresh_interval", 3600), jitter=jitter)
+        self.scheduler.add_job("image_db_cleanup", self.image_storage.cleanup_expired,
+                               daily_at=self.config.get("cleanup_time", "04:00"), jitter=jitter)
+        self.scheduler.add_job("temp_sweep", self._sweep_temp_files,
+                               interval=self.config.get("temp_file_max_age", 3600), jitter=jitter, run_at_start=True)
+        self.scheduler.add_job("journal_checkpoint", self.task_journal.checkpoint, interval=3600, jitter=jitter)
+        self.scheduler.add_job("state_purge", self._purge_state_stores, interval=600, jitter=60)
+        self.scheduler.add_job("status_report", self._log_status_report,
+                               interval=self.config.get("status_report_interval", 3600), jitter=60)
+
+    def _scheduled_sign_in(self):
+        """跨天后自动签到"""
+        if self.need_login or not self.config.get("cookie"):
+            return
+        self._auto_sign_in()
+
+    def _scheduled_credit_refresh(self):
+        """定时刷新积分信息"""
+        if self.need_login or not self.config.get("cookie"):
+            return
+        self._get_credit_info()
+
+    def _sweep_temp_files(self):
+        """清理超过保留时间的临时文件，正在使用的新文件不受影响"""
+        self.image_processor.cleanup_temp_files(max_age=self.config.get("temp_file_max_age", 3600))
+
+    def _purge_state_stores(self):
+        """清理各会话状态存储中已过期的条目"""
+        for store in (self.login_waiting_users, self.sms_tokens, self.sketch_waiting_users, self.upload_waiting_users):
+            count = store.purge_expired()
+            if count:
+                logger.info(f"[TYHH] {store.name} 清理过期条目 {count} 条")
+
+    def _log_status_report(self):
+        """定期在日志中输出运行状态"""
+        for stats in self.get_state_metrics():
+            logger.info(
+                f"[TYHH] 状态存储 {stats['name']}: 当前 {stats['live']}/{stats['capacity']} 条，"
+                f"已过期 {stats['expired']} 条，已淘汰 {stats['evicted']} 条"
+            )
+        
+        def format_time(timestamp):
+            return time.strftime("%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else "-"
+        
+        for stats in self.get_maintenance_stats():
+            duration = f"{stats['last_duration']:.2f}s" if stats["last_duration"] is not None else "-"
+            error = f"，最近错误: {stats['last_error']}" if stats["last_error"] else ""
+            logger.info(
+                f"[TYHH] 维护任务 {stats['name']}: 上次运行 {format_time(stats['last_run'])}，耗时 {duration}，"
+                f"下次运行 {format_time(stats['next_run'])}，已运行 {stats['run_count']} 次{error}"
+            )
+        
+        top_rejected = [record for record in self.get_rejection_stats()[:5] if record.get("hits")]
+        if top_rejected:
+            logger.info(
+                "[TYHH] 被拒绝提示词命中次数最多的前5个（可据此补充屏蔽词）: " +
+                "；".join(f"{record['prompt']} ×{record['hits']}" for record in top_rejected)
+            )
+
+    def get_maintenance_stats(self):
+        """获取各维护任务最近一次运行时间、耗时和下次运行时间"""
+        return self.scheduler.stats()
+
+    def _background_start(self):
+        """启动后的后台工作：自动签到、更新积分，然后继续处理重启前未完成的任务"""
+        start_time = time.time()
         try:
-            if os.path.exists(config_path):
-                with open(config_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            else:
-                # 创建默认配置文件
-                default_config = {
-                    "cookie": "",
-                    "last_sign_in_date": "",
-                    "resolutions": [
-                        "1024*1024",
-                        "1280*720",
-                        "720*1280",
-                        "1152*864",
-                        "864*1152"
-                    ]
-                }
-                with open(config_path, "w", encoding="utf-8") as f:
-                    json.dump(default_config, f, indent=2, ensure_ascii=False)
-                    logger.info("[TYHH] 创建默认配置文件")
-                return default_config
+            self._auto_sign_in()
         except Exception as e:
-            logger.error(f"[TYHH] Failed to load config: {e}")
-            return {}
+            logger.error(f"[TYHH] 后台签到失败: {e}")
+        logger.info(f"[TYHH] 后台签到完成，耗时 {time.time() - start_time:.2f}s")
+        self._resume_pending_tasks(self._pending_at_start)
+
+    def _default_config(self):
+        """配置文件不存在时使用的默认配置"""
+        return {
+            "cookie": "",
+            "last_sign_in_date": "",
+            "resolutions": [
+                "1024*1024",
+                "1280*720",
+                "720*1280",
+                "1152*864",
+                "864*1152"
+            ],
+            "image_resample": "lanczos",
+            "image_streaming": True,
+            "image_max_decode_mb": 64,
+            "image_workers": 2,
+            "output_format": "jpeg",
+            "output_max_kb": 500,
+            "output_subsampling": "4:2:0",
+            "sketch_output_mode": "L",
+            "oss_policy_ttl": 300,
+            "oss_url_ttl": 3600,
+            "state_ttl": 600,
+            "state_capacity": 1000,
+            "state_backend": "memory",
+            "state_db_path": "",
+            "rate_limit_per_minute": 60,
+            "rate_limit_burst": 10,
+            "task_journal_path": "",
+            "request_timeout": 30,
+            "image_timeout": 60,
+            "poll_interval": 10,
+            "task_deadline": 360,
+            "sign_in_time": "00:05",
+            "credit_refresh_interval": 3600,
+            "cleanup_time": "04:00",
+            "temp_file_max_age": 3600,
+            "maintenance_jitter": 300,
+            "blocked_keywords": [],
+            "rejected_prompt_ttl": 86400,
+            "rejected_prompt_capacity": 1000,
+            "batch_max_prompts": 10,
+            "status_report_interval": 3600
+        }
             
-    def _save_config(self):
-        """保存配置到文件"""
+    def _save_config(self, immediate=False):
+        """保存配置到文件，短时间内的多次保存合并为一次原子写入
+        Args:
+            immediate: 立即写入，凭证更新时使用
+        """
+        self.config_store.save(immediate)
+
+    def _on_config_reloaded(self, previous):
+        """配置文件被手动修改后，同步依赖配置的状态"""
+        if self.config.get("blocked_keywords") != previous.get("blocked_keywords"):
+            self.keyword_filter = self._build_keyword_filter()
+            logger.info(f"[TYHH] 屏蔽词已更新: {len(self.keyword_filter)} 个")
+        
+        # 超时和轮询配置
+        self.request_timeout = self.config.get("request_timeout", 30)
+        self.image_timeout = self.config.get("image_timeout", 60)
+        self.poll_interval = self.config.get("poll_interval", 10)
+        self.task_deadline = self.config.get("task_deadline", 360)
+        self.submit_retry.timeout = self.request_timeout
+        self.poll_retry.timeout = self.request_timeout
+        
+        # 图片输出配置变化时，下次使用时按新配置重新创建图片处理器
+        image_keys = ("image_resample", "image_streaming", "image_max_decode_mb",
+                      "output_format", "output_max_kb", "output_subsampling")
+        if any(self.config.get(key) != previous.get(key) for key in image_keys):
+            with self._image_processor_lock:
+                self._image_processor = None
+            logger.info("[TYHH] 图片输出配置已更新")
+        
+        self.xsrf_token = self.config.get("xsrf_token", self.xsrf_token)
+        self.last_sign_in_date = self.config.get("last_sign_in_date", self.last_sign_in_date)
+        if self.config.get("cookie") and self.config.get("cookie") != previous.get("cookie"):
+            logger.info("[TYHH] 配置文件中已更新cookie")
+            self.need_login = False
+
+    def _build_keyword_filter(self):
+        """按配置创建屏蔽词过滤器"""
+        from .keyword_filter import KeywordFilter
+        keywords = self.config.get("blocked_keywords") or []
+        if not isinstance(keywords, list):
+            # 写成字符串时每个字符都会成为屏蔽词，几乎所有提示词都会被拦截
+            logger.warning(f"[TYHH] blocked_keywords 应为列表，当前为 {type(keywords).__name__}，已忽略")
+            keywords = []
+        return KeywordFilter(keywords)
+
+    def _adopt_shared_credentials(self, max_age=None):
+        """加载其他进程更新到配置文件中的凭证，需在持有config_lock时调用
+        Args:
+            max_age: 只加载该时间（秒）内更新的凭证，None表示不限制
+        Returns:
+            bool: 是否加载了新凭证
+        """
+        disk_config = self.config_store.read_file()
+        if disk_config is None:
+            return False
+        
+        updated_at = disk_config.get("credentials_updated_at", 0)
+        if updated_at <= self.config.get("credentials_updated_at", 0):
+            return False
+        if max_age is not None and time.time() - updated_at > max_age:
+            return False
+        
+        for key in ("cookie", "xsrf_token", "credentials_updated_at"):
+            if key in disk_config:
+                self.config[key] = disk_config[key]
+        self.xsrf_token = self.config.get("xsrf_token", self.xsrf_token)
+        self.last_token_check = updated_at
+        logger.info("[TYHH] 已加载其他进程更新的凭证")
+        return True
+
+    def _api_post(self, url, **kwargs):
+        """在共享请求配额内发送接口请求，未指定超时时使用默认超时"""
+        kwargs.setdefault("timeout", self.request_timeout)
+        self.rate_limiter.acquire()
+        return self.session.post(url, **kwargs)
+
+    def _new_deadline(self, name):
+        """创建一次请求处理的时间预算，并交给看门狗监控"""
+        from .retry_policy import Deadline
+        return self.watchdog.watch(Deadline(self.task_deadline, name))
+
+    def _screen_prompt(self, prompt, e_context, task_type="text_to_image_v2"):
+        """提交前检查提示词是否包含屏蔽词或近期被服务端拒绝过，命中时直接回复用户
+        Returns:
+            bool: 是否被拦截
+        """
+        keyword = self.keyword_filter.find(prompt)
+        if keyword:
+            logger.info(f"[TYHH] 提示词包含屏蔽词，已拦截: {keyword}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"提示词包含不支持的内容「{keyword}」，请修改后重试")
+            e_context.action = EventAction.BREAK_PASS
+            return True
+        
+        reason = self._check_rejected_prompt(prompt, task_type)
+        if reason:
+            e_context["reply"] = Reply(ReplyType.TEXT, f"相同的提示词近期已被拒绝（{reason}），请修改后重试")
+            e_context.action = EventAction.BREAK_PASS
+            return True
+        return False
+
+    @staticmethod
+    def _rejection_key(prompt, task_type):
+        """拒绝缓存的键：任务类型 + 规范化的提示词（忽略大小写和多余空白）"""
+        return f"{task_type}:{' '.join(prompt.lower().split())}"
+
+    def _check_rejected_prompt(self, prompt, task_type):
+        """提示词近期被服务端拒绝过时返回拒绝原因，并累计命中次数"""
+        if not prompt:
+            return None
+        key = self._rejection_key(prompt, task_type)
+        record = self.rejected_prompts.get(key)
+        if not record:
+            return None
+        # 有效期从被拒绝时算起，重复提交不会延长
+        if time.time() >= record.get("expire_at", 0):
+            self.rejected_prompts.pop(key, None)
+            return None
+        record["hits"] = record.get("hits", 0) + 1
+        self.rejected_prompts[key] = record
+        logger.info(f"[TYHH] 提示词近期被拒绝过，已拦截（第 {record['hits']} 次）: {prompt}")
+        return record["reason"]
+
+    def _record_rejected_prompt(self, original_params, reason):
+        """记录被服务端拒绝的提示词"""
+        if not original_params or not original_params.get("prompt"):
+            return
+        if original_params.get("base_image"):
+            # 带参考图或涂鸦的任务可能是因为图片被拒绝，不能据此拦截相同的提示词
+            return
+        prompt = original_params["prompt"]
+        task_type = original_params.get("task_type", "text_to_image_v2")
+        now = time.time()
         try:
-            config_path = os.path.join(os.path.dirname(__file__), "config.json")
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(self.config, f, indent=2, ensure_ascii=False)
-                logger.info("[TYHH] 配置文件保存成功")
+            self.rejected_prompts[self._rejection_key(prompt, task_type)] = {
+                "prompt": prompt,
+                "task_type": task_type,
+                "reason": reason,
+                "hits": 0,
+                "rejected_at": now,
+                "expire_at": now + self.rejected_prompt_ttl
+            }
         except Exception as e:
-            logger.error(f"[TYHH] 保存配置文件失败: {e}")
+            logger.warning(f"[TYHH] 记录被拒绝的提示词失败: {e}")
+
+    def get_rejection_stats(self):
+        """获取被拒绝提示词的命中次数，按命中次数从高到低排列，可据此补充屏蔽词"""
+        now = time.time()
+        records = [record for _, record in self.rejected_prompts.items() if record.get("expire_at", 0) > now]
+        return sorted(records, key=lambda record: record.get("hits", 0), reverse=True)
+
+    def get_state_metrics(self):
+        """获取各会话状态存储的当前条目数等统计信息"""
+        return [
+            store.stats() for store in (
+                self.login_waiting_users,
+                self.sms_tokens,
+                self.sketch_waiting_users,
+                self.upload_waiting_users,
+                self.rejected_prompts
+            )
+        ]
 
     def get_help_text(self, **kwargs):
         help_text = "通义绘画插件使用说明：\n"
@@ -116,7 +474,10 @@ class TongyiDrawingPlugin(Plugin):
         help_text += "4. 发送 '通义积分' 查询当前积分\n"
         help_text += "5. 发送 '通义手绘 [提示词] [-比例] [-风格]' 进行手绘创作\n"
         help_text += "   支持的风格: -扁平(默认), -油画, -二次元, -水彩, -3D\n"
-        help_text += "6. 发送 '通义上传 [提示词]' 上传图片进行AI创作\n"
+        help_text += "6. 发送 '通义上传 [提示词] [-比例] [-风格]' 上传图片进行AI创作\n"
+        help_text += "7. 发送 '通义批量' 并在后面每行写一个提示词，批量生成图片\n"
+        help_text += "参数可写在提示词中任意位置，'-2张' 可指定返回图片数量，\n"
+        help_text += "'-1:1/16:9/9:16' 可同时生成多个比例并发送对比图\n"
         return help_text
 
     def _auto_sign_in(self):
@@ -180,7 +541,7 @@ class TongyiDrawingPlugin(Plugin):
         
         try:
             logger.info(f"[TYHH] 发送签到请求: {url}")
-            response = requests.post(url, headers=headers, json=data)
+            response = self._api_post(url, headers=headers, json=data)
             
             logger.info(f"[TYHH] 签到响应状态码: {response.status_code}")
             logger.debug(f"[TYHH] 签到响应内容: {response.text}")
@@ -235,7 +596,7 @@ class TongyiDrawingPlugin(Plugin):
         
         try:
             logger.info(f"[TYHH] 发送积分查询请求: {url}")
-            response = requests.post(url, headers=headers, json=data)
+            response = self._api_post(url, headers=headers, json=data)
             
             logger.info(f"[TYHH] 积分查询响应状态码: {response.status_code}")
             
@@ -265,595 +626,927 @@ class TongyiDrawingPlugin(Plugin):
             return 0, 0
 
     def on_handle_context(self, e_context: EventContext):
-        if e_context["context"].type not in [ContextType.TEXT, ContextType.IMAGE]:
+        context = e_context["context"]
+        if context.type == ContextType.TEXT:
+            content = context.content.strip()
+            handler = self.router.match(content)
+            # 不是插件命令且不在登录流程中，直接忽略
+            if handler is None and not self.need_login:
+                return
+        elif context.type == ContextType.IMAGE:
+            content = context.content
+            handler = self._handle_image_message
+        else:
             return
-            
-        content = e_context["context"].content.strip()
+        
+        # 配置文件被修改后重新加载（最多每秒检查一次mtime）
+        self.config_store.reload_if_changed()
         
         # 获取用户ID
-        msg = e_context["context"].kwargs.get("msg")
+        msg = context.kwargs.get("msg")
         user_id = None
         if msg:
             user_id = getattr(msg, "from_user_id", None) or getattr(msg, "other_user_id", None)
+        
+        # 处理登录流程：插件命令或正在登录的用户的消息
+        if context.type == ContextType.TEXT and self.need_login:
+            if handler is None and (not user_id or user_id not in self.login_waiting_users):
+                return
+            if self._handle_login_message(content, user_id, e_context):
+                return
+            if handler is None:
+                return
+        
+        handler(content, user_id, e_context)
+
+    def _build_router(self):
+        """构建命令路由表"""
+        from .command_router import CommandRouter
+        router = CommandRouter()
+        router.add("通义积分", self._handle_credit_command, exact=True)
+        router.add("通义手绘", self._handle_sketch_command)
+        router.add("通义上传", self._handle_upload_command)
+        router.add("通义批量", self._handle_batch_command)
+        router.add("通义", self._handle_generate_command)
+        router.add("t ", self._handle_enlarge_command)
+        return router
+
+    def _handle_image_message(self, image_path, user_id, e_context):
+        """处理图片消息：用户处于手绘或上传等待状态时处理图片"""
+        if not user_id:
+            return
+        # 图片未下载成功时保留等待状态，用户可以直接重新发送图片
+        if not os.path.exists(image_path):
+            if user_id in self.sketch_waiting_users or user_id in self.upload_waiting_users:
+                e_context["reply"] = Reply(ReplyType.TEXT, "图片下载失败，请重新发送图片")
+                e_context.action = EventAction.BREAK_PASS
+            return
+        # 原子地取出等待状态，多进程部署时只有一个进程会处理这张图片
+        sketch_data = self.sketch_waiting_users.claim(user_id)
+        if sketch_data:
+            self._handle_sketch_image(sketch_data, e_context)
+            return
+        upload_data = self.upload_waiting_users.claim(user_id)
+        if upload_data:
+            self._handle_upload_image(upload_data, e_context)
+
+    def _handle_sketch_image(self, sketch_data, e_context):
+        """处理用户发送的涂鸦图片"""
+        try:
+            image_path = e_context["context"].content
+
+            from .command_parser import DrawRequest
+            request = DrawRequest.from_dict(sketch_data)
+            prompt = request.prompt
+            resolution = request.resolution
+            style = request.style or "<flat illustration>"  # 默认扁平插画
+            
+            # 预处理图片
+            processed_image = self._preprocess_sketch_image(image_path, resolution)
+            if not processed_image:
+                e_context["reply"] = Reply(ReplyType.TEXT, "图片处理失败，请重试")
+                e_context.action = EventAction.BREAK_PASS
+                return
             
-        # 处理图片消息
-        if e_context["context"].type == ContextType.IMAGE:
-            # 处理手绘等待状态
-            if user_id in self.sketch_waiting_users:
-                try:
-                    # 下载图片
-                    image_path = e_context["context"].content
-                    if not os.path.exists(image_path):
-                        e_context["reply"] = Reply(ReplyType.TEXT, "图片下载失败，请重试")
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                        
-                    # 预处理图片
-                    processed_image_path = self._preprocess_sketch_image(image_path)
-                    if not processed_image_path:
-                        e_context["reply"] = Reply(ReplyType.TEXT, "图片处理失败，请重试")
-                        e_context.action = EventAction.BREAK_PASS
-                        return
-                    
-                    user_data = self.sketch_waiting_users[user_id]
-                    prompt = user_data["prompt"]
-                    resolution = user_data["resolution"]
-                    style = user_data["style"]
-                    
-                    # 发送等待消息
-                    wait_reply = Reply(ReplyType.TEXT, "正在处理您的手绘作品，请稍候......")
-                    e_context["channel"].send(wait_reply, e_context["context"])
-                    
-                    # 上传处理后的图片到OSS
-                    oss_url = self._upload_image_to_oss(processed_image_path, "sketch_to_image")
-                    if not oss_url:
-                        raise Exception("图片上传失败")
-                        
-                    # 清理临时文件
-                    try:
-                        os.remove(processed_image_path)
-                    except:
-                        pass
-                    
-                    # 提交任务
-                    task_id = self._send_image_gen_request(
-                        self._get_headers(),
-                        prompt,
-                        resolution,
-                        task_type="sketch_to_image",
-                        base_image=oss_url,
-                        style=style
-                    )
-                    
-                    if not task_id:
-                        raise Exception("创建任务失败")
-                        
-                    # 获取结果
-                    original_params = {
-                        "prompt": prompt,
-                        "resolution": resolution,
-                        "task_type": "sketch_to_image",
-                        "base_image": oss_url,
-                        "style": style
-                    }
-                    task_result = self._get_task_result(self._get_headers(), task_id, original_params)
-                    if not task_result:
-                        raise Exception("获取结果失败")
-                        
-                    # 提取URL并保存
-                    download_urls = []
-                    for item in task_result:
-                        url = item.get("downloadUrl")
-                        if url:
-                            download_urls.append(url)
-                            
-                    if not download_urls:
-                        raise Exception("未获取到生成图片")
-                        
-                    # 获取当前积分信息
-                    total_credits, _ = self._get_credit_info()
-                    
-                    # 存储图片信息
-                    img_id = str(int(time.time()))
-                    self.image_storage.store_image(
-                        img_id,
-                        download_urls,
-                        metadata={
-                            "prompt": prompt,
-                            "type": "sketch",
-                            "style": style,
-                            "resolution": resolution
-                        }
-                    )
+            # 发送等待消息
+            wait_reply = Reply(ReplyType.TEXT, "正在处理您的手绘作品，请稍候......")
+            e_context["channel"].send(wait_reply, e_context["context"])
+            
+            # 上传、提交、轮询共享同一个时间预算
+            deadline = self._new_deadline("sketch_to_image")
+            
+            # 上传处理后的图片到OSS
+            oss_url = self._upload_image_to_oss(processed_image, "sketch_to_image", file_name=f"sketch_{uuid.uuid4().hex}.png", deadline=deadline)
+            if not oss_url:
+                raise Exception("图片上传失败")
+            
+            # 提交任务
+            task_id = self._send_image_gen_request(
+                self._get_headers(),
+                prompt,
+                resolution,
+                task_type="sketch_to_image",
+                base_image=oss_url,
+                style=style,
+                deadline=deadline
+            )
+            
+            if not task_id:
+                raise Exception("创建任务失败")
+                
+            # 获取结果
+            original_params = {
+                "prompt": prompt,
+                "resolution": resolution,
+                "task_type": "sketch_to_image",
+                "base_image": oss_url,
+                "style": style
+            }
+            task_result = self._track_task_result(self._get_headers(), task_id, original_params, e_context, deadline)
+            if not task_result:
+                raise Exception("获取结果失败")
+                
+            # 提取URL并保存
+            download_urls = []
+            for item in task_result:
+                url = item.get("downloadUrl")
+                if url:
+                    download_urls.append(url)
                     
-                    # 合并并发送图片
-                    if len(download_urls) >= 4:
-                        if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
-                            # 如果合并失败,发送单张图片
-                            logger.warning("[TYHH] 图片合并失败，发送单张图片")
-                            for url in download_urls:
-                                e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                            help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                            e_context["reply"] = Reply(ReplyType.TEXT, help_text)
-                    else:
-                        # 直接发送单张图片
-                        logger.info(f"[TYHH] 图片数量少于4张，直接发送 {len(download_urls)} 张单图")
-                        for url in download_urls:
-                            e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                        help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                        e_context["reply"] = Reply(ReplyType.TEXT, help_text)
-                except Exception as e:
-                    logger.error(f"[TYHH] 处理手绘图片失败: {e}")
-                    e_context["reply"] = Reply(ReplyType.TEXT, f"处理失败: {str(e)}")
+            if not download_urls:
+                raise Exception("未获取到生成图片")
+            download_urls = download_urls[:request.count]
+                
+            # 获取当前积分信息
+            total_credits, _ = self._get_credit_info()
+            
+            # 存储图片信息
+            img_id = str(int(time.time()))
+            self.image_storage.store_image(
+                img_id,
+                download_urls,
+                metadata={
+                    "prompt": prompt,
+                    "type": "sketch",
+                    "style": style,
+                    "resolution": resolution
+                }
+            )
+            
+            # 合并并发送图片
+            if len(download_urls) >= 4:
+                if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
+                    # 如果合并失败,发送单张图片
+                    logger.warning("[TYHH] 图片合并失败，发送单张图片")
+                    for url in download_urls:
+                        e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                    help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                    e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+            else:
+                # 直接发送单张图片
+                logger.info(f"[TYHH] 图片数量少于4张，直接发送 {len(download_urls)} 张单图")
+                for url in download_urls:
+                    e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+        except Exception as e:
+            logger.error(f"[TYHH] 处理手绘图片失败: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"处理失败: {str(e)}")
+            
+        finally:
+            e_context.action = EventAction.BREAK_PASS
+
+    def _handle_upload_image(self, upload_data, e_context):
+        """处理用户上传的参考图片"""
+        try:
+            image_path = e_context["context"].content
+
+            from .command_parser import DrawRequest
+            request = DrawRequest.from_dict(upload_data)
+            prompt = request.prompt
+            resolution = request.resolution
+            
+            # 发送等待消息
+            wait_reply = Reply(ReplyType.TEXT, "正在处理您上传的图片，请稍候......")
+            e_context["channel"].send(wait_reply, e_context["context"])
+            
+            # 规范化图片后上传到OSS
+            upload_image = self._normalize_upload_image(image_path, resolution)
+            if not upload_image:
+                raise Exception("图片处理失败")
+            mime_type, ext = self.image_processor.mime_type(upload_image)
+            deadline = self._new_deadline("upload_to_image")
+            oss_url = self._upload_image_to_oss(
+                upload_image,
+                "text_to_image_v2",
+                file_name=f"upload_{uuid.uuid4().hex}{ext}",
+                mime_type=mime_type,
+                deadline=deadline
+            )
+            if not oss_url:
+                raise Exception("图片上传失败")
+                
+            # 提交任务
+            task_id = self._send_image_gen_request(
+                self._get_headers(),
+                prompt,
+                resolution,
+                task_type="text_to_image_v2",
+                base_image=oss_url,
+                style=request.style,
+                deadline=deadline
+            )
+            
+            if not task_id:
+                raise Exception("创建任务失败")
+                
+            # 获取结果
+            original_params = {
+                "prompt": prompt,
+                "resolution": resolution,
+                "task_type": "text_to_image_v2",
+                "base_image": oss_url,
+                "style": request.style
+            }
+            task_result = self._track_task_result(self._get_headers(), task_id, original_params, e_context, deadline)
+            if not task_result:
+                raise Exception("获取结果失败")
+                
+            # 提取URL并保存
+            download_urls = []
+            for item in task_result:
+                url = item.get("downloadUrl")
+                if url:
+                    download_urls.append(url)
                     
-                finally:
-                    # 清理状态
-                    self.sketch_waiting_users.pop(user_id, None)
-                    e_context.action = EventAction.BREAK_PASS
-                return
+            if not download_urls:
+                raise Exception("未获取到生成图片")
+            download_urls = download_urls[:request.count]
                 
-            # 处理上传等待状态
-            elif user_id in self.upload_waiting_users:
+            # 获取当前积分信息
+            total_credits, _ = self._get_credit_info()
+            
+            # 存储图片信息
+            img_id = str(int(time.time()))
+            self.image_storage.store_image(
+                img_id,
+                download_urls,
+                metadata={
+                    "prompt": prompt,
+                    "type": "upload"
+                }
+            )
+            
+            # 合并并发送图片
+            if len(download_urls) >= 4:
+                if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
+                    # 如果合并失败,发送单张图片
+                    logger.warning("[TYHH] 图片合并失败，发送单张图片")
+                    for url in download_urls:
+                        e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                    help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                    e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+            else:
+                # 直接发送单张图片
+                logger.info(f"[TYHH] 图片数量少于4张，直接发送 {len(download_urls)} 张单图")
+                for url in download_urls:
+                    e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+        except Exception as e:
+            logger.error(f"[TYHH] 处理上传图片失败: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"处理失败: {str(e)}")
+            
+        finally:
+            e_context.action = EventAction.BREAK_PASS
+
+    def _handle_login_message(self, content, user_id, e_context):
+        """处理登录流程：提示输入手机号、发送验证码、验证码登录
+        Returns:
+            bool: 消息是否已被登录流程处理
+        """
+        # 如果是第一次遇到需要登录的情况，并且没有等待手机号的用户
+        if user_id and user_id not in self.login_waiting_users:
+            self.login_waiting_users[user_id] = "phone"
+            login_msg = "通义绘画插件需要登录。\n请输入您的手机号码以接收验证码："
+            e_context["reply"] = Reply(ReplyType.TEXT, login_msg)
+            e_context.action = EventAction.BREAK_PASS
+            return True
+        
+        # 如果用户正在等待输入手机号
+        if user_id in self.login_waiting_users and self.login_waiting_users[user_id] == "phone":
+            # 检查输入是否是有效的手机号
+            if len(content) == 11 and content.isdigit():
+                # 发送验证码
                 try:
-                    # 下载图片
-                    image_path = e_context["context"].content
-                    if not os.path.exists(image_path):
-                        e_context["reply"] = Reply(ReplyType.TEXT, "图片下载失败，请重试")
+                    sms_token = self._send_sms_code(content)
+                    if sms_token:
+                        self.sms_tokens[user_id] = {"phone": content, "token": sms_token}
+                        self.login_waiting_users[user_id] = "sms"
+                        e_context["reply"] = Reply(ReplyType.TEXT, "验证码已发送，请输入收到的6位验证码")
                         e_context.action = EventAction.BREAK_PASS
-                        return
-                        
-                    prompt = self.upload_waiting_users[user_id]["prompt"]
-                    
-                    # 发送等待消息
-                    wait_reply = Reply(ReplyType.TEXT, "正在处理您上传的图片，请稍候......")
-                    e_context["channel"].send(wait_reply, e_context["context"])
-                    
-                    # 上传图片到OSS
-                    oss_url = self._upload_image_to_oss(image_path, "text_to_image_v2")
-                    if not oss_url:
-                        raise Exception("图片上传失败")
-                        
-                    # 提交任务
-                    task_id = self._send_image_gen_request(
-                        self._get_headers(),
-                        prompt,
-                        "1024*1024",
-                        task_type="text_to_image_v2",
-                        base_image=oss_url
-                    )
-                    
-                    if not task_id:
-                        raise Exception("创建任务失败")
-                        
-                    # 获取结果
-                    original_params = {
-                        "prompt": prompt,
-                        "resolution": "1024*1024",
-                        "task_type": "text_to_image_v2",
-                        "base_image": oss_url
-                    }
-                    task_result = self._get_task_result(self._get_headers(), task_id, original_params)
-                    if not task_result:
-                        raise Exception("获取结果失败")
-                        
-                    # 提取URL并保存
-                    download_urls = []
-                    for item in task_result:
-                        url = item.get("downloadUrl")
-                        if url:
-                            download_urls.append(url)
-                            
-                    if not download_urls:
-                        raise Exception("未获取到生成图片")
-                        
-                    # 存储图片信息
-                    img_id = str(int(time.time()))
-                    self.image_storage.store_image(
-                        img_id,
-                        download_urls,
-                        metadata={
-                            "prompt": prompt,
-                            "type": "upload"
-                        }
-                    )
-                    
-                    # 合并并发送图片
-                    if len(download_urls) >= 4:
-                        if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
-                            # 如果合并失败,发送单张图片
-                            logger.warning("[TYHH] 图片合并失败，发送单张图片")
-                            for url in download_urls:
-                                e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                            help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                            e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+                        return True
                     else:
-                        # 如果合并失败,发送单张图片
-                        logger.warning("[TYHH] 图片合并失败，发送单张图片")
-                        for url in download_urls:
-                            e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                        help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                        e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+                        e_context["reply"] = Reply(ReplyType.TEXT, "发送验证码失败，请重试")
+                        self.login_waiting_users.pop(user_id, None)
                 except Exception as e:
-                    logger.error(f"[TYHH] 处理上传图片失败: {e}")
-                    e_context["reply"] = Reply(ReplyType.TEXT, f"处理失败: {str(e)}")
-                    
-                finally:
-                    # 清理状态
-                    self.upload_waiting_users.pop(user_id, None)
-                    e_context.action = EventAction.BREAK_PASS
-                return
-                
-        # 处理文本消息
-        if e_context["context"].type != ContextType.TEXT:
-            return
-            
-        # 处理登录流程
-        if self.need_login:
-            # 如果是第一次遇到需要登录的情况，并且没有等待手机号的用户
-            if user_id and user_id not in self.login_waiting_users:
-                self.login_waiting_users[user_id] = "phone"
-                login_msg = "通义绘画插件需要登录。\n请输入您的手机号码以接收验证码："
-                e_context["reply"] = Reply(ReplyType.TEXT, login_msg)
-                e_context.action = EventAction.BREAK_PASS
-                return
+                    logger.error(f"[TYHH] 发送验证码失败: {e}")
+                    e_context["reply"] = Reply(ReplyType.TEXT, f"发送验证码失败: {str(e)}")
+                    self.login_waiting_users.pop(user_id, None)
+            else:
+                e_context["reply"] = Reply(ReplyType.TEXT, "请输入11位手机号码")
+            e_context.action = EventAction.BREAK_PASS
+            return True
             
-            # 如果用户正在等待输入手机号
-            if user_id in self.login_waiting_users and self.login_waiting_users[user_id] == "phone":
-                # 检查输入是否是有效的手机号
-                if len(content) == 11 and content.isdigit():
-                    # 发送验证码
-                    try:
-                        sms_token = self._send_sms_code(content)
-                        if sms_token:
-                            self.sms_tokens[user_id] = {"phone": content, "token": sms_token}
-                            self.login_waiting_users[user_id] = "sms"
-                            e_context["reply"] = Reply(ReplyType.TEXT, "验证码已发送，请输入收到的6位验证码")
-                            e_context.action = EventAction.BREAK_PASS
-                            return
-                        else:
-                            e_context["reply"] = Reply(ReplyType.TEXT, "发送验证码失败，请重试")
+        # 如果用户正在等待输入验证码
+        elif user_id in self.login_waiting_users and self.login_waiting_users[user_id] == "sms":
+            # 检查验证码格式
+            if len(content) == 6 and content.isdigit():
+                # 使用验证码登录
+                try:
+                    if user_id in self.sms_tokens:
+                        phone = self.sms_tokens[user_id]["phone"]
+                        sms_token = self.sms_tokens[user_id]["token"]
+                        
+                        cookie = self._login_with_sms(phone, content, sms_token)
+                        if cookie:
+                            # 登录成功，更新配置
+                            self.config["cookie"] = cookie
+                            self.config["credentials_updated_at"] = time.time()
+                            self._save_config(immediate=True)
+                            
+                            # 清理登录状态
+                            self.need_login = False
                             self.login_waiting_users.pop(user_id, None)
-                    except Exception as e:
-                        logger.error(f"[TYHH] 发送验证码失败: {e}")
-                        e_context["reply"] = Reply(ReplyType.TEXT, f"发送验证码失败: {str(e)}")
-                        self.login_waiting_users.pop(user_id, None)
-                else:
-                    e_context["reply"] = Reply(ReplyType.TEXT, "请输入11位手机号码")
-                e_context.action = EventAction.BREAK_PASS
-                return
-                
-            # 如果用户正在等待输入验证码
-            elif user_id in self.login_waiting_users and self.login_waiting_users[user_id] == "sms":
-                # 检查验证码格式
-                if len(content) == 6 and content.isdigit():
-                    # 使用验证码登录
-                    try:
-                        if user_id in self.sms_tokens:
-                            phone = self.sms_tokens[user_id]["phone"]
-                            sms_token = self.sms_tokens[user_id]["token"]
+                            self.sms_tokens.pop(user_id, None)
                             
-                            cookie = self._login_with_sms(phone, content, sms_token)
-                            if cookie:
-                                # 登录成功，更新配置
-                                self.config["cookie"] = cookie
-                                self._save_config()
-                                
-                                # 清理登录状态
-                                self.need_login = False
-                                self.login_waiting_users.pop(user_id, None)
-                                self.sms_tokens.pop(user_id, None)
-                                
-                                # 登录成功后进行签到
-                                self._auto_sign_in()
-                                
-                                e_context["reply"] = Reply(ReplyType.TEXT, "登录成功！现在可以使用通义绘画了")
-                                e_context.action = EventAction.BREAK_PASS
-                                return
-                            else:
-                                e_context["reply"] = Reply(ReplyType.TEXT, "登录失败，请重试")
-                                self.login_waiting_users.pop(user_id, None)
-                                self.sms_tokens.pop(user_id, None)
+                            # 登录成功后立即运行签到任务，运行时间计入维护任务状态
+                            self.scheduler.run_now("sign_in")
+                            
+                            e_context["reply"] = Reply(ReplyType.TEXT, "登录成功！现在可以使用通义绘画了")
+                            e_context.action = EventAction.BREAK_PASS
+                            return True
                         else:
-                            e_context["reply"] = Reply(ReplyType.TEXT, "登录状态已失效，请重新获取验证码")
+                            e_context["reply"] = Reply(ReplyType.TEXT, "登录失败，请重试")
                             self.login_waiting_users.pop(user_id, None)
-                    except Exception as e:
-                        logger.error(f"[TYHH] 登录过程中出错: {e}")
-                        e_context["reply"] = Reply(ReplyType.TEXT, f"登录失败: {str(e)}")
+                            self.sms_tokens.pop(user_id, None)
+                    else:
+                        e_context["reply"] = Reply(ReplyType.TEXT, "登录状态已失效，请重新获取验证码")
                         self.login_waiting_users.pop(user_id, None)
-                        self.sms_tokens.pop(user_id, None)
-                else:
-                    e_context["reply"] = Reply(ReplyType.TEXT, "请输入6位验证码")
-                e_context.action = EventAction.BREAK_PASS
-                return
-                
-            # 如果需要登录但无法获取用户ID，则提示错误
-            if not user_id:
-                e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID，请联系管理员")
-                e_context.action = EventAction.BREAK_PASS
-                return
+                except Exception as e:
+                    logger.error(f"[TYHH] 登录过程中出错: {e}")
+                    e_context["reply"] = Reply(ReplyType.TEXT, f"登录失败: {str(e)}")
+                    self.login_waiting_users.pop(user_id, None)
+                    self.sms_tokens.pop(user_id, None)
+            else:
+                e_context["reply"] = Reply(ReplyType.TEXT, "请输入6位验证码")
+            e_context.action = EventAction.BREAK_PASS
+            return True
+            
+        # 如果需要登录但无法获取用户ID，则提示错误
+        if not user_id:
+            e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID，请联系管理员")
+            e_context.action = EventAction.BREAK_PASS
+            return True
+        return False
+
+    def _handle_credit_command(self, content, user_id, e_context):
+        """处理查询积分命令"""
+        try:
+            total_credits, available_credits = self._get_credit_info()
+            if total_credits > 0:
+                e_context["reply"] = Reply(ReplyType.TEXT, f"账号积分信息：\n总积分：{total_credits}\n可用积分：{available_credits}")
+            else:
+                e_context["reply"] = Reply(ReplyType.TEXT, "获取积分信息失败，请稍后重试")
+        except Exception as e:
+            logger.error(f"[TYHH] 处理积分查询命令出错: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"查询积分失败: {str(e)}")
+        e_context.action = EventAction.BREAK_PASS
+
+    def _handle_sketch_command(self, content, user_id, e_context):
+        """处理手绘命令：发送空白画布并等待用户涂鸦"""
+        if not user_id:
+            e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID")
+            e_context.action = EventAction.BREAK_PASS
+            return
+            
+        # 检查是否已登录
+        if self.need_login:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义手绘功能")
+            e_context.action = EventAction.BREAK_PASS
+            return
+            
+        # 解析命令参数
+        request = self.command_parser.parse(content, "通义手绘")
+        logger.info(f"[TYHH] 解析命令结果: {request}")
+        prompt = request.prompt
+        resolution = request.resolution
         
-        # 处理查询积分命令
-        if content == "通义积分":
-            try:
-                total_credits, available_credits = self._get_credit_info()
-                if total_credits > 0:
-                    e_context["reply"] = Reply(ReplyType.TEXT, f"账号积分信息：\n总积分：{total_credits}\n可用积分：{available_credits}")
-                else:
-                    e_context["reply"] = Reply(ReplyType.TEXT, "获取积分信息失败，请稍后重试")
-                e_context.action = EventAction.BREAK_PASS
-                return
-            except Exception as e:
-                logger.error(f"[TYHH] 处理积分查询命令出错: {e}")
-                e_context["reply"] = Reply(ReplyType.TEXT, f"查询积分失败: {str(e)}")
-                e_context.action = EventAction.BREAK_PASS
-                return
+        if not prompt:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请输入绘画提示词")
+            e_context.action = EventAction.BREAK_PASS
+            return
+        if self._screen_prompt(prompt, e_context):
+            return
+            
+        # 获取对应分辨率的空白图片
+        blank_image = self._get_blank_image(resolution)
+        if not blank_image:
+            e_context["reply"] = Reply(ReplyType.TEXT, "创建空白图片失败")
+            e_context.action = EventAction.BREAK_PASS
+            return
+            
+        # 记录用户状态和参数
+        self.sketch_waiting_users[user_id] = request.to_dict()
+        
+        # 等待用户涂鸦期间提前预热
+        self._start_warm_up("sketch_to_image")
         
-        # 处理放大图片命令
-        if content.startswith("t "):
-            self._handle_enlarge_command(content, e_context)
+        # 发送空白图片和提示
+        try:
+            image_reply = Reply(ReplyType.IMAGE, BytesIO(blank_image))
+            e_context["channel"].send(image_reply, e_context["context"])
+            e_context["reply"] = Reply(ReplyType.TEXT, f"请在{resolution.replace('*', 'x')}的空白图片上进行涂鸦，完成后发送给我")
+        except Exception as e:
+            logger.error(f"[TYHH] 发送空白图片失败: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, "创建空白画布失败，请重试")
+        e_context.action = EventAction.BREAK_PASS
+
+    def _handle_upload_command(self, content, user_id, e_context):
+        """处理上传命令：记录提示词并等待用户发送图片"""
+        if not user_id:
+            e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID")
+            e_context.action = EventAction.BREAK_PASS
+            return
+            
+        # 检查是否已登录
+        if self.need_login:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义上传功能")
+            e_context.action = EventAction.BREAK_PASS
+            return
+            
+        # 解析提示词和参数
+        request = self.command_parser.parse(content, "通义上传")
+        if not request.prompt:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请输入绘画提示词")
+            e_context.action = EventAction.BREAK_PASS
+            return
+        if self._screen_prompt(request.prompt, e_context):
             return
+            
+        # 记录用户状态
+        self.upload_waiting_users[user_id] = request.to_dict()
+        
+        # 等待用户发送图片期间提前预热
+        self._start_warm_up("text_to_image_v2")
+        
+        # 发送提示
+        e_context["reply"] = Reply(ReplyType.TEXT, "请发送需要处理的图片")
+        e_context.action = EventAction.BREAK_PASS
 
-        # 处理手绘命令
-        if content.startswith("通义手绘"):
-            if not user_id:
-                e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID")
-                e_context.action = EventAction.BREAK_PASS
-                return
+    def _handle_generate_command(self, content, user_id, e_context):
+        """处理生成图片命令"""
+        request = self.command_parser.parse(content, "通义")
+        logger.info(f"[TYHH] 解析命令结果: {request}")
+        prompt = request.prompt
+        resolution = request.resolution
+        
+        if not prompt:
+            e_context["reply"] = Reply(ReplyType.ERROR, "请输入绘画提示词")
+            e_context.action = EventAction.BREAK_PASS
+            return
+        if self._screen_prompt(prompt, e_context):
+            return
+
+        # 检查是否已登录
+        if self.need_login:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义绘画功能")
+            e_context.action = EventAction.BREAK_PASS
+            return
+        
+        # 指定了多个比例时同时生成
+        if request.is_fan_out:
+            self._handle_fan_out(request, e_context)
+            return
+
+        try:
+            # 发送等待消息
+            wait_reply = Reply(ReplyType.TEXT, "通义正在绘画,请稍候......")
+            e_context["channel"].send(wait_reply, e_context["context"])
+            
+            # 检查并刷新token
+            current_time = time.time()
+            if current_time - self.last_token_check > 3600:  # 1小时刷新一次token
+                logger.info("[TYHH] Token超过1小时未刷新，进行刷新")
+                refresh_result = self._refresh_token()
+                self.last_token_check = current_time
+                logger.info(f"[TYHH] Token刷新结果: {refresh_result}")
+            
+            # 准备请求头
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36',
+                'Accept': 'application/json, text/plain, */*',
+                'Accept-Language': 'zh-CN,zh;q=0.9',
+                'Content-Type': 'application/json',
+                'Origin': 'https://tongyi.aliyun.com',
+                'Referer': 'https://tongyi.aliyun.com/wanxiang/creation',
+                'x-platform': 'web',
+                'Cookie': self.config.get('cookie', '')
+            }
+            
+            # 如果有xsrf token，添加到请求头
+            if self.xsrf_token:
+                headers['x-xsrf-token'] = self.xsrf_token
+                logger.info(f"[TYHH] 使用现有的xsrf-token: {self.xsrf_token}")
+            
+            # 生成图片
+            logger.info(f"[TYHH] 开始生成图片，提示词: {prompt}，分辨率: {resolution}")
+            deadline = self._new_deadline("text_to_image_v2")
+            task_id = self._send_image_gen_request(headers, prompt, resolution, style=request.style, deadline=deadline)
+            
+            # 如果请求失败且疑似cookie失效，尝试刷新token
+            if not task_id:
+                logger.info("[TYHH] 尝试刷新token并重新提交请求")
+                self._refresh_token()
+                # 更新headers中的cookie
+                headers['Cookie'] = self.config.get('cookie', '')
+                if self.xsrf_token:
+                    headers['x-xsrf-token'] = self.xsrf_token
+                # 重新尝试生成图片
+                task_id = self._send_image_gen_request(headers, prompt, resolution, style=request.style, deadline=deadline)
                 
-            # 检查是否已登录
-            if self.need_login:
-                e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义手绘功能")
+            # 如果仍然失败，标记需要登录，并让用户知道
+            if not task_id:
+                logger.error("[TYHH] 图片生成请求两次尝试均失败，需要重新登录")
+                self.need_login = True
+                
+                if user_id:
+                    # 清除登录等待状态，以便重新开始登录流程
+                    if user_id in self.login_waiting_users:
+                        self.login_waiting_users.pop(user_id)
+                    if user_id in self.sms_tokens:
+                        self.sms_tokens.pop(user_id)
+                
+                e_context["reply"] = Reply(
+                    ReplyType.TEXT, 
+                    "图片生成失败，登录凭证已过期，需要重新登录。\n请输入手机号码以接收验证码："
+                )
+                self.login_waiting_users[user_id] = "phone"
                 e_context.action = EventAction.BREAK_PASS
                 return
                 
-            # 解析命令参数
-            prompt, resolution, style = self._parse_sketch_command(content)
-            
-            if not prompt:
-                e_context["reply"] = Reply(ReplyType.TEXT, "请输入绘画提示词")
+            # 获取任务结果
+            logger.info(f"[TYHH] 成功提交任务，任务ID: {task_id}，等待结果")
+            original_params = {
+                "prompt": prompt,
+                "resolution": resolution,
+                "task_type": "text_to_image_v2",
+                "style": request.style
+            }
+            task_result = self._track_task_result(headers, task_id, original_params, e_context, deadline)
+            if not task_result:
+                logger.error(f"[TYHH] 获取任务 {task_id} 结果失败")
+                e_context["reply"] = Reply(ReplyType.TEXT, "获取图片结果失败，请稍后重试")
                 e_context.action = EventAction.BREAK_PASS
                 return
                 
-            # 创建对应分辨率的空白图片
-            blank_image_path = self._create_blank_image(resolution)
-            if not blank_image_path:
-                e_context["reply"] = Reply(ReplyType.TEXT, "创建空白图片失败")
+            # 提取下载URL
+            logger.info(f"[TYHH] 成功获取任务结果，开始提取图片URL")
+            download_urls = []
+            for item in task_result:
+                url = item.get("downloadUrl")
+                if url:
+                    download_urls.append(url)
+            
+            if not download_urls:
+                logger.error("[TYHH] 未从任务结果中获取到图片URL")
+                e_context["reply"] = Reply(ReplyType.TEXT, "未获取到图片URL")
                 e_context.action = EventAction.BREAK_PASS
                 return
+            download_urls = download_urls[:request.count]
                 
-            # 记录用户状态和参数
-            self.sketch_waiting_users[user_id] = {
-                "prompt": prompt,
-                "resolution": resolution,
-                "style": style
-            }
+            # 存储图片信息
+            logger.info(f"[TYHH] 成功获取 {len(download_urls)} 张图片的URL，开始存储图片信息")
+            img_id = str(int(time.time()))
+            self.image_storage.store_image(
+                img_id,
+                download_urls,
+                metadata={
+                    "prompt": prompt,
+                    "type": "generate"
+                }
+            )
             
-            # 发送空白图片和提示
-            try:
-                with open(blank_image_path, 'rb') as f:
-                    image_reply = Reply(ReplyType.IMAGE, f)
-                    e_context["channel"].send(image_reply, e_context["context"])
-                e_context["reply"] = Reply(ReplyType.TEXT, f"请在{resolution.replace('*', 'x')}的空白图片上进行涂鸦，完成后发送给我")
-            except Exception as e:
-                logger.error(f"[TYHH] 发送空白图片失败: {e}")
-                e_context["reply"] = Reply(ReplyType.TEXT, "创建空白画布失败，请重试")
-            finally:
-                # 清理临时文件
-                try:
-                    os.remove(blank_image_path)
-                except:
-                    pass
+            logger.info(f"[TYHH] 图片信息存储成功，图片ID: {img_id}")
+            
+            # 查询当前积分
+            total_credits, _ = self._get_credit_info()
+            
+            # 合并图片并发送
+            if len(download_urls) >= 4:
+                if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
+                    # 如果合并失败,发送单张图片
+                    logger.warning("[TYHH] 图片合并失败，发送单张图片")
+                    for url in download_urls:
+                        e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                    help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                    e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+            else:
+                # 直接发送单张图片
+                logger.info(f"[TYHH] 图片数量少于4张，直接发送 {len(download_urls)} 张单图")
+                for url in download_urls:
+                    e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+                help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+                e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+            
+            e_context.action = EventAction.BREAK_PASS
+            
+        except Exception as e:
+            logger.error(f"[TYHH] 生成图片过程中出错: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"生成图片失败: {str(e)}")
+            e_context.action = EventAction.BREAK_PASS
+
+    def _handle_batch_command(self, content, user_id, e_context):
+        """处理批量生成命令：每行一个提示词，全部提交后一起轮询，每个任务完成后立即发送"""
+        lines = [line.strip() for line in content[len("通义批量"):].splitlines() if line.strip()]
+        if not lines:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请在'通义批量'后每行输入一个提示词")
+            e_context.action = EventAction.BREAK_PASS
+            return
+        max_prompts = self.config.get("batch_max_prompts", 10)
+        if len(lines) > max_prompts:
+            e_context["reply"] = Reply(ReplyType.TEXT, f"一次最多提交{max_prompts}个提示词")
             e_context.action = EventAction.BREAK_PASS
             return
-            
-        # 处理上传命令
-        if content.startswith("通义上传"):
-            if not user_id:
-                e_context["reply"] = Reply(ReplyType.TEXT, "无法获取用户ID")
-                e_context.action = EventAction.BREAK_PASS
-                return
-                
-            # 检查是否已登录
-            if self.need_login:
-                e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义上传功能")
-                e_context.action = EventAction.BREAK_PASS
-                return
-                
-            # 提取提示词
-            prompt = content[4:].strip()
-            if not prompt:
-                e_context["reply"] = Reply(ReplyType.TEXT, "请输入绘画提示词")
-                e_context.action = EventAction.BREAK_PASS
-                return
-                
-            # 记录用户状态
-            self.upload_waiting_users[user_id] = {"prompt": prompt}
-            
-            # 发送提示
-            e_context["reply"] = Reply(ReplyType.TEXT, "请发送需要处理的图片")
+        if self.need_login:
+            e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义批量功能")
             e_context.action = EventAction.BREAK_PASS
             return
+        
+        # 解析并检查每个提示词
+        requests_to_submit = []
+        summary = []
+        for line in lines:
+            request = self.command_parser.parse(line, "")
+            request.command = "通义批量"
+            reason = None
+            if not request.prompt:
+                reason = "提示词为空"
+            elif self.keyword_filter.find(request.prompt):
+                reason = "包含屏蔽词"
+            else:
+                rejected = self._check_rejected_prompt(request.prompt, "text_to_image_v2")
+                if rejected:
+                    reason = f"近期已被拒绝: {rejected}"
+            if reason:
+                summary.append(f"✗ {line}（{reason}）")
+            else:
+                requests_to_submit.append(request)
+        
+        try:
+            e_context["channel"].send(
+                Reply(ReplyType.TEXT, f"通义正在批量绘画，共{len(requests_to_submit)}个任务，完成一个发送一个......"),
+                e_context["context"]
+            )
             
-        # 处理生成图片命令
-        if content.startswith("通义"):
-            # 解析命令
-            prompt = content[2:].strip()
-            resolution = "1024*1024"  # 默认分辨率1:1
-            
-            # 检查是否包含分辨率参数
-            ratio_mapping = {
-                "-1:1": "1024*1024",
-                "-16:9": "1280*720",
-                "-9:16": "720*1280",
-                "-4:3": "1152*864",
-                "-3:4": "864*1152"
-            }
-            
-            # 检查简写形式
-            for ratio, res in ratio_mapping.items():
-                if prompt.endswith(ratio):
-                    resolution = res
-                    prompt = prompt[:-len(ratio)].strip()
-                    logger.info(f"[TYHH] 检测到分辨率参数: {ratio}, 使用分辨率: {resolution}")
-                    break
+            if time.time() - self.last_token_check > 3600:
+                self._refresh_token()
+                self.last_token_check = time.time()
+            headers = self._get_headers()
             
-            if not prompt:
-                e_context["reply"] = Reply(ReplyType.ERROR, "请输入绘画提示词")
-                e_context.action = EventAction.BREAK_PASS
-                return
+            # 依次提交，请求速率由共享配额控制；每个任务从提交开始有各自的时间预算
+            polls = []
+            for index, request in enumerate(requests_to_submit, 1):
+                deadline = self._new_deadline(f"batch {index}")
+                task_id = self._send_image_gen_request(
+                    headers,
+                    request.prompt,
+                    request.resolution,
+                    style=request.style,
+                    deadline=deadline
+                )
+                if not task_id:
+                    summary.append(f"✗ {request.prompt}（提交失败）")
+                    continue
+                original_params = {
+                    "prompt": request.prompt,
+                    "resolution": request.resolution,
+                    "task_type": "text_to_image_v2",
+                    "style": request.style
+                }
+                self._journal_task(task_id, original_params, e_context)
+                poll = self._new_task_poll(task_id, original_params, deadline=deadline, detect_stall=False)
+                poll["request"] = request
+                polls.append(poll)
+            
+            # 一起轮询，每个任务完成后立即发送
+            unfinished = self._poll_task_group(
+                headers,
+                polls,
+                lambda poll, task_result: summary.append(self._deliver_batch_result(poll["request"], task_result, e_context))
+            )
+            for poll in unfinished:
+                summary.append(f"✗ {poll['request'].prompt}（超时）")
+        except Exception as e:
+            logger.error(f"[TYHH] 批量生成过程中出错: {e}")
+            summary.append(f"批量生成中断: {str(e)}")
+        
+        e_context["reply"] = Reply(ReplyType.TEXT, "批量绘画完成：\n" + "\n".join(summary))
+        e_context.action = EventAction.BREAK_PASS
 
-            # 检查是否已登录
-            if self.need_login:
-                e_context["reply"] = Reply(ReplyType.TEXT, "请先完成登录后再使用通义绘画功能")
-                e_context.action = EventAction.BREAK_PASS
-                return
+    def _poll_task_group(self, headers, polls, on_finished):
+        """一起轮询一组任务，每轮查询所有未完成的任务一次
+        组内任务同时提交，排队时可能长时间停在0%，因此不按连续0%进度判定为被拒绝，
+        每个任务按各自的时间预算单独超时
+        Args:
+            polls: _new_task_poll创建的轮询状态列表，须带有各自的deadline
+            on_finished: 任务结束时的回调 on_finished(poll, task_result)
+        Returns:
+            list: 时间预算用完时仍未结束的任务
+        """
+        from .retry_policy import DeadlineExceeded
+        
+        polls = list(polls)
+        unfinished = []
+        while polls:
+            for poll in list(polls):
+                try:
+                    finished, task_result = self._poll_task_once(headers, poll, poll["deadline"])
+                except DeadlineExceeded as e:
+                    logger.error(f"[TYHH] 任务超时: {e}")
+                    polls.remove(poll)
+                    self.task_journal.record_done(poll["task_id"])
+                    unfinished.append(poll)
+                    continue
+                if not finished:
+                    continue
+                polls.remove(poll)
+                self.task_journal.record_done(poll["task_id"])
+                on_finished(poll, task_result)
+            if polls:
+                time.sleep(min(self.poll_interval, max(poll["deadline"].remaining() for poll in polls)))
+        return unfinished
 
-            try:
-                # 发送等待消息
-                wait_reply = Reply(ReplyType.TEXT, "通义正在绘画,请稍候......")
-                e_context["channel"].send(wait_reply, e_context["context"])
-                
-                # 检查并刷新token
-                current_time = time.time()
-                if current_time - self.last_token_check > 3600:  # 1小时刷新一次token
-                    logger.info("[TYHH] Token超过1小时未刷新，进行刷新")
-                    refresh_result = self._refresh_token()
-                    self.last_token_check = current_time
-                    logger.info(f"[TYHH] Token刷新结果: {refresh_result}")
-                
-                # 准备请求头
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36',
-                    'Accept': 'application/json, text/plain, */*',
-                    'Accept-Language': 'zh-CN,zh;q=0.9',
-                    'Content-Type': 'application/json',
-                    'Origin': 'https://tongyi.aliyun.com',
-                    'Referer': 'https://tongyi.aliyun.com/wanxiang/creation',
-                    'x-platform': 'web',
-                    'Cookie': self.config.get('cookie', '')
-                }
-                
-                # 如果有xsrf token，添加到请求头
-                if self.xsrf_token:
-                    headers['x-xsrf-token'] = self.xsrf_token
-                    logger.info(f"[TYHH] 使用现有的xsrf-token: {self.xsrf_token}")
-                
-                # 生成图片
-                logger.info(f"[TYHH] 开始生成图片，提示词: {prompt}，分辨率: {resolution}")
-                task_id = self._send_image_gen_request(headers, prompt, resolution)
-                
-                # 如果请求失败且疑似cookie失效，尝试刷新token
-                if not task_id:
-                    logger.info("[TYHH] 尝试刷新token并重新提交请求")
-                    self._refresh_token()
-                    # 更新headers中的cookie
-                    headers['Cookie'] = self.config.get('cookie', '')
-                    if self.xsrf_token:
-                        headers['x-xsrf-token'] = self.xsrf_token
-                    # 重新尝试生成图片
-                    task_id = self._send_image_gen_request(headers, prompt, resolution)
-                    
-                # 如果仍然失败，标记需要登录，并让用户知道
+    def _handle_fan_out(self, request, e_context):
+        """同一个提示词同时生成多个比例，全部完成后发送带比例标注的对比图"""
+        from .command_parser import RATIO_RESOLUTIONS
+        
+        try:
+            e_context["channel"].send(
+                Reply(ReplyType.TEXT, f"通义正在以{len(request.ratios)}种比例同时绘画，请稍候......"),
+                e_context["context"]
+            )
+            
+            if time.time() - self.last_token_check > 3600:
+                self._refresh_token()
+                self.last_token_check = time.time()
+            headers = self._get_headers()
+            
+            # 各比例依次提交，作为一组任务跟踪；每个任务从提交开始有各自的时间预算
+            group = []
+            for ratio in request.ratios:
+                resolution = RATIO_RESOLUTIONS[ratio]
+                deadline = self._new_deadline(f"fan_out {ratio}")
+                task_id = self._send_image_gen_request(
+                    headers,
+                    request.prompt,
+                    resolution,
+                    style=request.style,
+                    deadline=deadline
+                )
                 if not task_id:
-                    logger.error("[TYHH] 图片生成请求两次尝试均失败，需要重新登录")
-                    self.need_login = True
-                    
-                    if user_id:
-                        # 清除登录等待状态，以便重新开始登录流程
-                        if user_id in self.login_waiting_users:
-                            self.login_waiting_users.pop(user_id)
-                        if user_id in self.sms_tokens:
-                            self.sms_tokens.pop(user_id)
-                    
-                    e_context["reply"] = Reply(
-                        ReplyType.TEXT, 
-                        "图片生成失败，登录凭证已过期，需要重新登录。\n请输入手机号码以接收验证码："
-                    )
-                    self.login_waiting_users[user_id] = "phone"
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                    
-                # 获取任务结果
-                logger.info(f"[TYHH] 成功提交任务，任务ID: {task_id}，等待结果")
+                    logger.error(f"[TYHH] 比例 {ratio} 提交失败")
+                    continue
                 original_params = {
-                    "prompt": prompt,
+                    "prompt": request.prompt,
                     "resolution": resolution,
-                    "task_type": "text_to_image_v2"
+                    "task_type": "text_to_image_v2",
+                    "style": request.style
                 }
-                task_result = self._get_task_result(headers, task_id, original_params)
-                if not task_result:
-                    logger.error(f"[TYHH] 获取任务 {task_id} 结果失败")
-                    e_context["reply"] = Reply(ReplyType.TEXT, "获取图片结果失败，请稍后重试")
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                    
-                # 提取下载URL
-                logger.info(f"[TYHH] 成功获取任务结果，开始提取图片URL")
-                download_urls = []
-                for item in task_result:
-                    url = item.get("downloadUrl")
-                    if url:
-                        download_urls.append(url)
-                
-                if not download_urls:
-                    logger.error("[TYHH] 未从任务结果中获取到图片URL")
-                    e_context["reply"] = Reply(ReplyType.TEXT, "未获取到图片URL")
-                    e_context.action = EventAction.BREAK_PASS
-                    return
-                    
-                # 存储图片信息
-                logger.info(f"[TYHH] 成功获取 {len(download_urls)} 张图片的URL，开始存储图片信息")
-                img_id = str(int(time.time()))
+                self._journal_task(task_id, original_params, e_context)
+                poll = self._new_task_poll(task_id, original_params, deadline=deadline, detect_stall=False)
+                poll["ratio"] = ratio
+                group.append(poll)
+            
+            if not group:
+                e_context["reply"] = Reply(ReplyType.TEXT, "创建任务失败，请稍后重试")
+                e_context.action = EventAction.BREAK_PASS
+                return
+            
+            results = {}  # 比例 -> 图片URL列表
+            
+            def on_finished(poll, task_result):
+                urls = [item.get("downloadUrl") for item in task_result or [] if item.get("downloadUrl")]
+                if urls:
+                    results[poll["ratio"]] = urls[:request.count]
+            
+            self._poll_task_group(headers, group, on_finished)
+            if not results:
+                e_context["reply"] = Reply(ReplyType.TEXT, "获取图片结果失败，请稍后重试")
+                e_context.action = EventAction.BREAK_PASS
+                return
+            
+            # 每个比例保存为一组图片，对比图中展示各比例的第一张
+            lines = []
+            sheet_entries = []
+            img_id = int(time.time())
+            for ratio in request.ratios:
+                urls = results.get(ratio)
+                if not urls:
+                    lines.append(f"{ratio}：生成失败")
+                    continue
+                while self.image_storage.get_image(str(img_id)):
+                    img_id += 1
                 self.image_storage.store_image(
-                    img_id,
-                    download_urls,
+                    str(img_id),
+                    urls,
                     metadata={
-                        "prompt": prompt,
-                        "type": "generate"
+                        "prompt": request.prompt,
+                        "type": "fan_out",
+                        "resolution": RATIO_RESOLUTIONS[ratio]
                     }
                 )
-                
-                logger.info(f"[TYHH] 图片信息存储成功，图片ID: {img_id}")
-                
-                # 查询当前积分
-                total_credits, _ = self._get_credit_info()
-                
-                # 合并图片并发送
-                if len(download_urls) >= 4:
-                    if not self._combine_and_send_images(download_urls, e_context, total_credits, img_id):
-                        # 如果合并失败,发送单张图片
-                        logger.warning("[TYHH] 图片合并失败，发送单张图片")
-                        for url in download_urls:
-                            e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                        help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                        e_context["reply"] = Reply(ReplyType.TEXT, help_text)
-                else:
-                    # 直接发送单张图片
-                    logger.info(f"[TYHH] 图片数量少于4张，直接发送 {len(download_urls)} 张单图")
-                    for url in download_urls:
-                        e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
-                    help_text = f"图片生成成功！账号积分：{total_credits}\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
-                    e_context["reply"] = Reply(ReplyType.TEXT, help_text)
-                
-                e_context.action = EventAction.BREAK_PASS
-                
-            except Exception as e:
-                logger.error(f"[TYHH] 生成图片过程中出错: {e}")
-                e_context["reply"] = Reply(ReplyType.TEXT, f"生成图片失败: {str(e)}")
-                e_context.action = EventAction.BREAK_PASS
+                lines.append(f"{ratio}：图片ID {img_id}")
+                sheet_entries.append((urls[0], ratio))
+            
+            if not self._send_contact_sheet(sheet_entries, e_context):
+                for url, _ in sheet_entries:
+                    e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+            
+            help_text = "多比例绘画完成！\n" + "\n".join(lines) + "\n使用't 图片ID 序号'可以查看原图"
+            e_context["reply"] = Reply(ReplyType.TEXT, help_text)
+        except Exception as e:
+            logger.error(f"[TYHH] 多比例生成过程中出错: {e}")
+            e_context["reply"] = Reply(ReplyType.TEXT, f"生成图片失败: {str(e)}")
+        e_context.action = EventAction.BREAK_PASS
+
+    def _send_contact_sheet(self, entries, e_context):
+        """下载各比例的图片，生成带标注的对比图并发送
+        Args:
+            entries: [(图片URL, 标注文字)]
+        Returns:
+            bool: 是否发送成功
+        """
+        temp_files = []
+        sheet_path = None
+        try:
+            temp_dir = os.path.join(os.path.dirname(__file__), 'temp')
+            if not os.path.exists(temp_dir):
+                os.makedirs(temp_dir)
+            
+            # 下载图片到本地临时文件
+            sheet_entries = []
+            for i, (url, label) in enumerate(entries):
+                temp_file = os.path.join(temp_dir, f'sheet_{i}_{time.time()}.png')
+                response = self.session.get(url, stream=True, timeout=self.request_timeout)
+                if response.status_code != 200:
+                    logger.error(f"[TYHH] 下载图片失败: {url}")
+                    return False
+                with open(temp_file, 'wb') as f:
+                    for chunk in response.iter_content(1024):
+                        f.write(chunk)
+                temp_files.append(temp_file)
+                sheet_entries.append((temp_file, label))
+            
+            sheet_path = os.path.join(temp_dir, f'sheet_{time.time()}{self.image_processor.output_extension}')
+            success = self.image_executor.run(self.image_processor.contact_sheet, sheet_entries, sheet_path, timeout=self.image_timeout)
+            if not success:
+                logger.error("[TYHH] 生成对比图失败")
+                return False
+            self._send_local_image(sheet_path, e_context)
+            return True
+        except Exception as e:
+            logger.error(f"[TYHH] 生成对比图时出错: {e}")
+            return False
+        finally:
+            for path in temp_files + ([sheet_path] if sheet_path else []):
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except Exception as e:
+                    logger.error(f"[TYHH] 清理临时文件失败: {e}")
+
+    def _deliver_batch_result(self, request, task_result, e_context):
+        """保存并发送批量任务中一个任务的结果
+        Returns:
+            str: 该任务在汇总中的一行
+        """
+        download_urls = [item.get("downloadUrl") for item in task_result or [] if item.get("downloadUrl")]
+        if not download_urls:
+            return f"✗ {request.prompt}（生成失败）"
+        download_urls = download_urls[:request.count]
+        
+        # 存储图片信息，避免与同一批次中已有ID重复
+        img_id = str(int(time.time()))
+        while self.image_storage.get_image(img_id):
+            img_id = str(int(img_id) + 1)
+        self.image_storage.store_image(
+            img_id,
+            download_urls,
+            metadata={
+                "prompt": request.prompt,
+                "type": "batch",
+                "resolution": request.resolution
+            }
+        )
+        
+        if not self._combine_and_send_images(download_urls, e_context, img_id=img_id):
+            for url in download_urls:
+                e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+        e_context["channel"].send(Reply(ReplyType.TEXT, f"{request.prompt}\n图片ID: {img_id}"), e_context["context"])
+        return f"✓ {request.prompt}：{img_id}"
 
-    def _handle_enlarge_command(self, content, e_context):
+    def _handle_enlarge_command(self, content, user_id, e_context):
         """处理放大图片命令"""
         try:
             # 解析命令参数
-            parts = content.strip().split()
-            if len(parts) != 2:
+            parsed = self.command_parser.parse_enlarge(content)
+            if not parsed:
                 e_context["reply"] = Reply(ReplyType.TEXT, "请使用正确的格式：'t 图片ID 序号'")
                 e_context.action = EventAction.BREAK_PASS
                 return
                 
-            img_id = parts[0]
-            index = int(parts[1]) - 1
+            img_id, index = parsed
             
             # 从数据库获取图片信息
             image_info = self.image_storage.get_image(img_id)
@@ -876,12 +1569,14 @@ class TongyiDrawingPlugin(Plugin):
             e_context["channel"].send(wait_reply, e_context["context"])
             
             # 提交放大任务
+            deadline = self._new_deadline("image_upscale")
             task_id = self._send_image_gen_request(
                 self._get_headers(),
                 "",  # 放大时不需要prompt
                 resolution="2048*2048",  # 放大到更高分辨率
                 task_type="image_upscale",
-                base_image=original_url
+                base_image=original_url,
+                deadline=deadline
             )
             
             if not task_id:
@@ -895,7 +1590,7 @@ class TongyiDrawingPlugin(Plugin):
                 "task_type": "image_upscale",
                 "base_image": original_url
             }
-            task_result = self._get_task_result(self._get_headers(), task_id, original_params)
+            task_result = self._track_task_result(self._get_headers(), task_id, original_params, e_context, deadline)
             
             if not task_result:
                 e_context["reply"] = Reply(ReplyType.TEXT, "获取放大结果失败")
@@ -941,6 +1636,14 @@ class TongyiDrawingPlugin(Plugin):
             e_context.action = EventAction.BREAK_PASS
 
     def _refresh_token(self):
+        """刷新token，多个进程共享配置时只有一个进程执行刷新，其他进程直接加载结果"""
+        with self.config_lock:
+            if self._adopt_shared_credentials(max_age=300):
+                logger.info("[TYHH] 其他进程刚刷新过token，跳过刷新")
+                return True
+            return self._do_refresh_token()
+
+    def _do_refresh_token(self):
         """使用新API获取token并更新cookie"""
         try:
             # 生成XSRF-Token
@@ -975,7 +1678,8 @@ class TongyiDrawingPlugin(Plugin):
             response = requests.post(
                 'https://qianwen.biz.aliyun.com/dialog/im/getToken',
                 headers=headers,
-                json=data
+                json=data,
+                timeout=self.request_timeout
             )
             
             logger.info(f"[TYHH] token获取响应状态码: {response.status_code}")
@@ -1001,7 +1705,10 @@ class TongyiDrawingPlugin(Plugin):
                         self._fetch_cookie_with_token(token)
                     
                     # 保存配置
-                    self._save_config()
+                    self.config["xsrf_token"] = self.xsrf_token
+                    self.config["credentials_updated_at"] = time.time()
+                    # 在config_lock内立即写入，其他进程获取锁后读到的是新凭证，不会重复刷新
+                    self._save_config(immediate=True)
                     logger.info("[TYHH] Token刷新成功")
                     return True
                 else:
@@ -1030,7 +1737,8 @@ class TongyiDrawingPlugin(Plugin):
             # 访问绘画页面，获取完整cookie
             response = requests.get(
                 'https://wanxiang.aliyun.com/wanx/api/common/imagineCount',
-                headers=headers
+                headers=headers,
+                timeout=self.request_timeout
             )
             
             logger.info(f"[TYHH] 更新cookie响应状态码: {response.status_code}")
@@ -1083,7 +1791,8 @@ class TongyiDrawingPlugin(Plugin):
             response = requests.get(
                 "https://wanxiang.aliyun.com/wanx/api/common/imagineCount",
                 headers=headers,
-                allow_redirects=False
+                allow_redirects=False,
+                timeout=self.request_timeout
             )
             
             logger.info(f"[TYHH] 获取cookie响应状态码: {response.status_code}")
@@ -1143,7 +1852,7 @@ class TongyiDrawingPlugin(Plugin):
         
         try:
             logger.info(f"[TYHH] 尝试向手机号 {phone} 发送验证码")
-            response = requests.post(url, headers=headers, params=params, data=data)
+            response = requests.post(url, headers=headers, params=params, data=data, timeout=self.request_timeout)
             
             logger.info(f"[TYHH] 验证码发送响应状态码: {response.status_code}")
             
@@ -1196,7 +1905,7 @@ class TongyiDrawingPlugin(Plugin):
         
         try:
             logger.info(f"[TYHH] 尝试使用短信验证码登录: {phone}")
-            response = requests.post(url, headers=headers, params=params, data=data)
+            response = requests.post(url, headers=headers, params=params, data=data, timeout=self.request_timeout)
             
             logger.info(f"[TYHH] 短信登录响应状态码: {response.status_code}")
             
@@ -1239,7 +1948,8 @@ class TongyiDrawingPlugin(Plugin):
             response = requests.get(
                 "https://wanxiang.aliyun.com/wanx/api/common/imagineCount",
                 headers=headers,
-                allow_redirects=False
+                allow_redirects=False,
+                timeout=self.request_timeout
             )
             
             logger.info(f"[TYHH] 获取完整cookie响应状态码: {response.status_code}")
@@ -1264,6 +1974,10 @@ class TongyiDrawingPlugin(Plugin):
 
     def generate_images(self, prompt, resolution="1024*1024"):
         """生成图片"""
+        if self.keyword_filter.find(prompt) or self._check_rejected_prompt(prompt, "text_to_image_v2"):
+            logger.info("[TYHH] 提示词包含屏蔽词或近期被拒绝过，不提交")
+            return []
+        
         # 检查并刷新token
         current_time = time.time()
         if current_time - self.last_token_check > 3600:  # 1小时刷新一次token
@@ -1285,29 +1999,29 @@ class TongyiDrawingPlugin(Plugin):
             headers['x-xsrf-token'] = self.xsrf_token
 
         # 发送绘画请求
-        task_id = self._send_image_gen_request(headers, prompt, resolution)
+        deadline = self._new_deadline("text_to_image_v2")
+        task_id = self._send_image_gen_request(headers, prompt, resolution, deadline=deadline)
         if not task_id:
             # 尝试刷新token后重试
             self._refresh_token()
             headers['Cookie'] = self.config.get('cookie', '')
-            task_id = self._send_image_gen_request(headers, prompt, resolution)
+            task_id = self._send_image_gen_request(headers, prompt, resolution, deadline=deadline)
             if not task_id:
                 return []
 
         # 获取任务结果
-        task_result = self._get_task_result(headers, task_id)
+        task_result = self._get_task_result(headers, task_id, deadline=deadline)
         if not task_result:
             return []
 
         # 提取图片URL
         return self._extract_high_quality_image_urls(task_result)
 
-    def _send_image_gen_request(self, headers, prompt, resolution="1024*1024", task_type="text_to_image_v2", base_image=None, style=None):
+    def _send_image_gen_request(self, headers, prompt, resolution="1024*1024", task_type="text_to_image_v2", base_image=None, style=None, deadline=None):
         """发送图片生成请求"""
-        max_retries = 3
-        current_retry = 0
+        from .retry_policy import DeadlineExceeded
         
-        while current_retry < max_retries:
+        for attempt in range(self.submit_retry.max_attempts):
             try:
                 url = "https://wanxiang.aliyun.com/wanx/api/common/imageGen"
                 
@@ -1349,7 +2063,7 @@ class TongyiDrawingPlugin(Plugin):
                 logger.info(f"[TYHH] Headers: {headers}")
                 logger.info(f"[TYHH] Payload: {payload}")
                 
-                response = requests.post(url, headers=headers, json=payload, timeout=30)
+                response = self._api_post(url, headers=headers, json=payload, timeout=self.submit_retry.attempt_timeout(deadline))
                 logger.info(f"[TYHH] 图片生成响应状态码: {response.status_code}")
                 logger.info(f"[TYHH] 响应内容: {response.text[:200]}")
                 
@@ -1363,20 +2077,25 @@ class TongyiDrawingPlugin(Plugin):
                         error_msg = result.get("errorMsg", "未知错误")
                         if "人数较多" in error_msg or "请稍后再试" in error_msg:
                             logger.warning(f"[TYHH] 服务繁忙: {error_msg}")
-                            time.sleep(5)
-                            current_retry += 1
-                            continue
                         else:
                             logger.error(f"[TYHH] 创建任务失败: {error_msg}")
                             return None
                 
-                current_retry += 1
-                time.sleep(3)
+                # 带抖动的指数退避后重试
+                if attempt + 1 < self.submit_retry.max_attempts:
+                    self.submit_retry.wait(attempt, deadline)
                 
+            except DeadlineExceeded as e:
+                logger.error(f"[TYHH] 提交任务超时: {e}")
+                return None
             except Exception as e:
                 logger.error(f"[TYHH] 发送请求出错: {str(e)}")
-                current_retry += 1
-                time.sleep(3)
+                try:
+                    if attempt + 1 < self.submit_retry.max_attempts:
+                        self.submit_retry.wait(attempt, deadline)
+                except DeadlineExceeded as e:
+                    logger.error(f"[TYHH] 提交任务超时: {e}")
+                    return None
                 
         return None
 
@@ -1400,65 +2119,201 @@ class TongyiDrawingPlugin(Plugin):
         }
         return style_map.get(style, "")
 
-    def _get_task_result(self, headers, task_id, original_params=None):
-        """获取任务结果"""
-        max_retries = 30  # 最大重试次数
-        retry_count = 0
-        interval = 10  # 轮询间隔
-        zero_progress_count = 0  # 连续0%进度计数
+    def _track_task_result(self, headers, task_id, original_params, e_context, deadline=None):
+        """将任务记入日志后轮询结果，轮询结束后标记完成"""
+        self._journal_task(task_id, original_params, e_context)
+        try:
+            return self._get_task_result(headers, task_id, original_params, deadline)
+        finally:
+            self.task_journal.record_done(task_id)
+
+    def _journal_task(self, task_id, original_params, e_context):
+        """将已提交的任务及其会话信息记入日志，重启后可继续获取结果"""
+        context = e_context["context"]
+        msg = context.kwargs.get("msg")
+        user_id = None
+        if msg:
+            user_id = getattr(msg, "from_user_id", None) or getattr(msg, "other_user_id", None)
+        
+        self.task_journal.record_submit(
+            task_id,
+            user_id,
+            {
+                "receiver": context.get("receiver"),
+                "isgroup": context.get("isgroup", False),
+                "session_id": context.get("session_id")
+            },
+            original_params
+        )
+
+    def _resume_pending_tasks(self, pending):
+        """继续轮询重启前未结束的任务，保存并发送结果
+        Args:
+            pending: 启动时（处理新消息前）取出的未结束任务记录
+        """
+        if not pending:
+            return
+        logger.info(f"[TYHH] 继续处理重启前未完成的任务: {len(pending)} 个")
         
-        while retry_count < max_retries:
+        for record in pending:
+            task_id = record["task_id"]
+            params = record.get("params") or {}
             try:
-                url = "https://wanxiang.aliyun.com/wanx/api/common/taskResult"
-                payload = {
-                    "taskId": task_id,
-                    "id": original_params.get("id") if original_params else None
-                }
-                
-                response = requests.post(url, headers=headers, json=payload)
-                if response.status_code != 200:
-                    logger.error(f"[TYHH] 任务查询失败,状态码: {response.status_code}")
-                    return None
-                    
-                result = response.json()
-                if not result.get("success"):
-                    logger.error(f"[TYHH] 任务查询响应错误: {result}")
-                    return None
-                    
-                task_data = result.get("data", {})
-                progress = task_data.get("taskRate", 0)
-                status = task_data.get("status")
-                
-                logger.info(f"[TYHH] 任务进度: {progress}%")
+                task_result = self._get_task_result(self._get_headers(), task_id, params)
+                download_urls = [item.get("downloadUrl") for item in task_result or [] if item.get("downloadUrl")]
+                if not download_urls:
+                    logger.warning(f"[TYHH] 重启前的任务 {task_id} 未获取到结果")
+                    continue
                 
-                # 检查任务状态
-                if progress == 100 or status == 2:  # 成功完成
-                    return task_data.get("taskResult", [])
-                elif status == 3:  # 失败
-                    logger.error(f"[TYHH] 任务失败: {result}")
-                    return None
-                    
-                # 检查连续0%进度
-                if progress == 0:
-                    zero_progress_count += 1
-                    if zero_progress_count >= 2:  # 连续两次0%进度
-                        logger.warning("[TYHH] 连续两次0%进度，任务可能被拒绝")
-                        return None
+                # 存储图片信息，避免与已有ID重复
+                img_id = str(int(time.time()))
+                while self.image_storage.get_image(img_id):
+                    img_id = str(int(img_id) + 1)
+                self.image_storage.store_image(
+                    img_id,
+                    download_urls,
+                    metadata={
+                        "prompt": params.get("prompt", ""),
+                        "type": "resumed",
+                        "task_type": params.get("task_type")
+                    }
+                )
+                self._deliver_resumed_result(record, download_urls, img_id)
+            except Exception as e:
+                logger.error(f"[TYHH] 处理重启前的任务 {task_id} 出错: {e}")
+            finally:
+                self.task_journal.record_done(task_id)
+        
+        self.task_journal.checkpoint()
+
+    def _deliver_resumed_result(self, record, download_urls, img_id):
+        """向提交任务的会话发送重启前任务的结果"""
+        try:
+            from bridge.context import Context
+            from channel import channel_factory
+            from config import conf
+            
+            context = Context(ContextType.TEXT, "", kwargs=dict(record.get("context") or {}))
+            channel = channel_factory.create_channel(conf().get("channel_type", "wx"))
+            for url in download_urls:
+                channel.send(Reply(ReplyType.IMAGE_URL, url), context)
+            help_text = f"重启前提交的任务已完成！\n图片ID: {img_id}\n使用't {img_id} 序号'可以查看原图"
+            channel.send(Reply(ReplyType.TEXT, help_text), context)
+        except Exception as e:
+            logger.error(f"[TYHH] 发送重启前任务结果失败，图片ID: {img_id}，错误: {e}")
+
+    def _on_shutdown(self):
+        """退出时关闭任务日志（未结束的任务由下次启动的进程接管），并关闭图片处理进程池"""
+        pending = self.task_journal.pending()
+        if pending:
+            logger.info(f"[TYHH] 退出时仍有 {len(pending)} 个任务未完成，将在下次启动时继续")
+        # 先停止维护任务，避免关闭后仍压缩任务日志
+        self.scheduler.stop()
+        self.task_journal.close()
+        self.config_store.flush()
+        self.image_executor.shutdown(wait=False)
+
+    def _get_task_result(self, headers, task_id, original_params=None, deadline=None):
+        """获取任务结果，轮询直到完成、失败或时间预算用完"""
+        from .retry_policy import DeadlineExceeded
+        
+        if deadline is None:
+            deadline = self._new_deadline(f"task {task_id}")
+        poll = self._new_task_poll(task_id, original_params)
+        
+        try:
+            while True:
+                finished, task_result = self._poll_task_once(headers, poll, deadline)
+                if finished:
+                    return task_result
+                if poll["error_count"]:
+                    self.poll_retry.wait(poll["error_count"] - 1, deadline)
                 else:
-                    zero_progress_count = 0  # 重置计数器
-                    
-                retry_count += 1
-                time.sleep(interval)
+                    deadline.sleep(self.poll_interval)
+        except DeadlineExceeded as e:
+            logger.error(f"[TYHH] 任务超时: {e}")
+            return None
+
+    @staticmethod
+    def _new_task_poll(task_id, original_params=None, deadline=None, detect_stall=True):
+        """创建任务轮询状态，供_poll_task_once使用
+        Args:
+            deadline: 任务的时间预算，一起轮询的任务须各自指定
+            detect_stall: 连续两次0%进度时是否判定任务被拒绝
+        """
+        return {
+            "task_id": task_id,
+            "params": original_params,
+            "deadline": deadline,
+            "detect_stall": detect_stall,
+            "zero_progress_count": 0,  # 连续0%进度计数
+            "error_count": 0  # 连续出错计数
+        }
+
+    def _poll_task_once(self, headers, poll, deadline=None):
+        """查询一次任务进度
+        Args:
+            poll: _new_task_poll创建的轮询状态，会更新其中的计数
+        Returns:
+            tuple: (是否结束, 任务结果)，失败结束时任务结果为None
+        """
+        from .retry_policy import DeadlineExceeded
+        
+        original_params = poll["params"]
+        try:
+            url = "https://wanxiang.aliyun.com/wanx/api/common/taskResult"
+            payload = {
+                "taskId": poll["task_id"],
+                "id": original_params.get("id") if original_params else None
+            }
+            
+            response = self._api_post(url, headers=headers, json=payload, timeout=self.poll_retry.attempt_timeout(deadline))
+            if response.status_code != 200:
+                logger.error(f"[TYHH] 任务查询失败,状态码: {response.status_code}")
+                return True, None
                 
-            except Exception as e:
-                logger.error(f"[TYHH] 查询任务出错: {str(e)}")
-                retry_count += 1
-                if retry_count >= max_retries:
-                    return None
-                time.sleep(interval)
+            result = response.json()
+            if not result.get("success"):
+                logger.error(f"[TYHH] 任务查询响应错误: {result}")
+                return True, None
                 
-        logger.error("[TYHH] 任务超时")
-        return None
+            task_data = result.get("data", {})
+            progress = task_data.get("taskRate", 0)
+            status = task_data.get("status")
+            poll["error_count"] = 0
+            
+            logger.info(f"[TYHH] 任务 {poll['task_id']} 进度: {progress}%")
+            
+            # 检查任务状态
+            if progress == 100 or status == 2:  # 成功完成
+                return True, task_data.get("taskResult", [])
+            elif status == 3:  # 失败
+                logger.error(f"[TYHH] 任务失败: {result}")
+                self._record_rejected_prompt(
+                    original_params,
+                    task_data.get("errorMsg") or result.get("errorMsg") or "任务失败"
+                )
+                return True, None
+                
+            # 检查连续0%进度
+            if progress == 0:
+                poll["zero_progress_count"] += 1
+                if poll["detect_stall"] and poll["zero_progress_count"] >= 2:  # 连续两次0%进度
+                    logger.warning("[TYHH] 连续两次0%进度，任务可能被拒绝")
+                    self._record_rejected_prompt(original_params, "任务未开始处理，可能包含不支持的内容")
+                    return True, None
+            else:
+                poll["zero_progress_count"] = 0  # 重置计数器
+            return False, None
+            
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"[TYHH] 查询任务出错: {str(e)}")
+            poll["error_count"] += 1
+            if poll["error_count"] >= self.poll_retry.max_attempts:
+                return True, None
+            return False, None
 
     def _extract_high_quality_image_urls(self, task_result):
         """提取高质量图片URL"""
@@ -1484,81 +2339,159 @@ class TongyiDrawingPlugin(Plugin):
             logger.error(f"[TYHH] 提取图片URL时出错: {e}")
             return []
 
-    def _create_blank_image(self, resolution="1024*1024"):
-        """创建空白图片，支持不同分辨率"""
+    def _get_blank_image(self, resolution="1024*1024"):
+        """获取空白图片数据，首次使用时缓存所有支持的分辨率"""
         try:
-            # 解析分辨率
-            width, height = map(int, resolution.split('*'))
-            
-            from PIL import Image
-            image = Image.new('RGB', (width, height), 'white')
-            temp_path = os.path.join(os.path.dirname(__file__), "temp", f"blank_{int(time.time())}.png")
-            
-            # 确保temp目录存在
-            temp_dir = os.path.dirname(temp_path)
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-                
-            image.save(temp_path)
-            logger.info(f"[TYHH] 创建空白图片成功: {width}x{height}")
-            return temp_path
+            self.image_processor.warm_blank_canvases(self.config.get("resolutions", []))
+            return self.image_processor.get_blank_canvas(resolution)
         except Exception as e:
             logger.error(f"[TYHH] 创建空白图片失败: {e}")
             return None
 
-    def _upload_image_to_oss(self, image_path, task_type):
-        """上传图片到OSS"""
+    def _start_warm_up(self, task_type, interval=60):
+        """用户进入等待状态时，在后台提前完成上传前的准备工作
+        Args:
+            interval: 同一任务类型正在预热或距上次预热完成不足该秒数时跳过
+        """
+        with self._warm_up_lock:
+            if task_type in self._warm_up_running:
+                return
+            if time.time() - self._warm_up_done.get(task_type, 0) < interval:
+                return
+            self._warm_up_running.add(task_type)
+        threading.Thread(target=self._warm_up, args=(task_type,), daemon=True).start()
+
+    def _warm_up(self, task_type):
+        """预热：检查token、建立连接、预取上传策略并启动图片处理进程"""
+        start_time = time.time()
+        try:
+            # 检查并刷新token
+            if time.time() - self.last_token_check > 3600:
+                logger.info("[TYHH] 预热时刷新token")
+                self._refresh_token()
+                self.last_token_check = time.time()
+            
+            # 建立到接口域名的连接，放入连接池
+            self.session.head('https://wanxiang.aliyun.com/', timeout=5)
+            
+            # 预取上传策略，并建立到OSS的连接
+            oss_host = self.oss_policy_cache.ensure(task_type)
+            if oss_host:
+                self.session.head(oss_host, timeout=5)
+            
+            # 加载图片处理器并启动图片处理进程
+            self.image_processor
+            self.image_executor.warm_up()
+            logger.info(f"[TYHH] 预热完成: {task_type}，耗时 {time.time() - start_time:.2f}s")
+            with self._warm_up_lock:
+                self._warm_up_done[task_type] = time.time()
+        except Exception as e:
+            logger.warning(f"[TYHH] 预热失败: {e}")
+        finally:
+            with self._warm_up_lock:
+                self._warm_up_running.discard(task_type)
+
+    def _fetch_oss_policy(self, task_type):
+        """获取OSS上传策略"""
         try:
-            # 获取上传策略
             policy_url = 'https://wanxiang.aliyun.com/wanx/api/oss/getPolicy'
             policy_data = {
-                "fileName": os.path.basename(image_path),
+                "fileName": f"{uuid.uuid4().hex}.png",
                 "taskType": task_type
             }
+            with self._api_post(policy_url, headers=self._get_headers(), json=policy_data) as policy_res:
+                policy_result = policy_res.json()
             
-            headers = self._get_headers()
-            policy_res = requests.post(policy_url, headers=headers, json=policy_data)
-            
-            if not policy_res.json().get('success'):
-                logger.error(f"[TYHH] 获取上传策略失败: {policy_res.text}")
+            if not policy_result.get('success'):
+                logger.error(f"[TYHH] 获取上传策略失败: {policy_result}")
                 return None
+            
+            logger.info(f"[TYHH] 获取上传策略成功: {task_type}")
+            return policy_result['data']
+        except Exception as e:
+            logger.error(f"[TYHH] 获取上传策略出错: {e}")
+            return None
+
+    def _upload_image_to_oss(self, image, task_type, file_name="image.png", mime_type="image/png", deadline=None):
+        """上传图片到OSS
+        Args:
+            image: 图片数据(bytes)或本地图片路径
+            task_type: 任务类型
+            file_name: 上传文件名（image为路径时使用路径中的文件名）
+            mime_type: 图片MIME类型
+            deadline: 本次请求的时间预算，为None时只使用单次请求超时
+        Returns:
+            str: 图片访问链接，失败时返回None
+        """
+        try:
+            if isinstance(image, str):
+                file_name = os.path.basename(image)
+                with open(image, 'rb') as f:
+                    image = f.read()
+            
+            # 相同图片在链接有效期内直接复用
+            digest = self.oss_url_index.digest(image)
+            oss_url = self.oss_url_index.get(task_type, digest)
+            if oss_url:
+                logger.info(f"[TYHH] 图片已上传过，复用访问链接: {digest[:12]}")
+                return oss_url
+            
+            # 复用缓存策略失败时，使用新策略重试一次
+            for attempt in range(2):
+                # 获取上传策略（优先使用缓存）
+                policy_info, key = self.oss_policy_cache.acquire(task_type, file_name)
+                if not policy_info:
+                    return None
+                reused = key != policy_info['key']
                 
-            policy_info = policy_res.json()['data']
-            
-            # 构造上传参数
-            upload_url = policy_info['host']
-            files = {
-                'key': (None, policy_info['key']),
-                'policy': (None, policy_info['policy']),
-                'OSSAccessKeyId': (None, policy_info['accessId']),
-                'signature': (None, policy_info['signature']),
-                'file': (unquote(os.path.basename(image_path)), open(image_path, 'rb'), 'image/png')
-            }
+                oss_url = self._post_image_to_oss(policy_info, key, image, task_type, file_name, mime_type, deadline)
+                if oss_url:
+                    self.oss_url_index.put(task_type, digest, oss_url)
+                    return oss_url
+                if not reused:
+                    return None
+                self.oss_policy_cache.invalidate(task_type, reused=True)
+            return None
             
-            # 发送上传请求
-            upload_res = requests.post(upload_url, files=files)
+        except Exception as e:
+            logger.error(f"[TYHH] 上传图片到OSS失败: {e}")
+            return None
+
+    def _post_image_to_oss(self, policy_info, key, image, task_type, file_name, mime_type, deadline=None):
+        """按上传策略将图片数据上传到OSS并生成访问链接"""
+        # 构造上传参数，直接从内存流式上传
+        upload_url = policy_info['host']
+        files = {
+            'key': (None, key),
+            'policy': (None, policy_info['policy']),
+            'OSSAccessKeyId': (None, policy_info['accessId']),
+            'signature': (None, policy_info['signature']),
+            'file': (unquote(file_name), BytesIO(image), mime_type)
+        }
+        
+        # 发送上传请求
+        timeout = self.submit_retry.attempt_timeout(deadline)
+        with self.session.post(upload_url, files=files, timeout=timeout) as upload_res:
             if upload_res.status_code not in [200, 204]:
                 logger.error(f"[TYHH] OSS上传失败: HTTP {upload_res.status_code}")
                 return None
-                
-            # 生成访问链接
-            generate_url = 'https://wanxiang.aliyun.com/wanx/api/oss/generateOssUrl'
-            generate_data = {
-                "key": policy_info['key'],
-                "taskType": task_type
-            }
-            generate_res = requests.post(generate_url, headers=headers, json=generate_data)
-            
-            if not generate_res.json().get('success'):
-                logger.error(f"[TYHH] 生成访问链接失败: {generate_res.text}")
-                return None
-                
-            return generate_res.json()['data']
             
-        except Exception as e:
-            logger.error(f"[TYHH] 上传图片到OSS失败: {e}")
+        # 生成访问链接
+        generate_url = 'https://wanxiang.aliyun.com/wanx/api/oss/generateOssUrl'
+        generate_data = {
+            "key": key,
+            "taskType": task_type
+        }
+        timeout = self.submit_retry.attempt_timeout(deadline)
+        with self._api_post(generate_url, headers=self._get_headers(), json=generate_data, timeout=timeout) as generate_res:
+            generate_result = generate_res.json()
+        
+        if not generate_result.get('success'):
+            logger.error(f"[TYHH] 生成访问链接失败: {generate_result}")
             return None
             
+        return generate_result['data']
+            
     def _get_headers(self):
         """获取请求头"""
         headers = {
@@ -1586,6 +2519,20 @@ class TongyiDrawingPlugin(Plugin):
         except Exception as e:
             logger.error(f"[TYHH] 发送本地图片失败: {e}")
             
+    def _send_image_url(self, url, e_context):
+        """下载图片并按输出配置压缩后发送，失败时直接发送URL"""
+        try:
+            response = self.session.get(url, timeout=self.request_timeout)
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}")
+            
+            data = self.image_executor.run_with_buffer(self.image_processor.reencode, response.content, timeout=self.image_timeout)
+            logger.info(f"[TYHH] 图片重新编码: {len(response.content)} -> {len(data)} 字节")
+            e_context["channel"].send(Reply(ReplyType.IMAGE, BytesIO(data)), e_context["context"])
+        except Exception as e:
+            logger.error(f"[TYHH] 压缩发送图片失败，改为发送URL: {e}")
+            e_context["channel"].send(Reply(ReplyType.IMAGE_URL, url), e_context["context"])
+            
     def _combine_and_send_images(self, download_urls, e_context, total_credits=0, img_id=None):
         """合并并发送图片"""
         temp_files = []
@@ -1605,7 +2552,7 @@ class TongyiDrawingPlugin(Plugin):
             # 下载图片到本地临时文件
             for i, url in enumerate(download_urls[:4]):
                 temp_file = os.path.join(temp_dir, f'temp_{i}_{time.time()}.png')
-                response = requests.get(url, stream=True)
+                response = self.session.get(url, stream=True, timeout=self.request_timeout)
                 if response.status_code == 200:
                     with open(temp_file, 'wb') as f:
                         for chunk in response.iter_content(1024):
@@ -1616,8 +2563,8 @@ class TongyiDrawingPlugin(Plugin):
                     return False
                     
             # 合并图片
-            merged_image_path = os.path.join(temp_dir, f'merged_{time.time()}.png')
-            success = self.image_processor.combine_images(temp_files, merged_image_path)
+            merged_image_path = os.path.join(temp_dir, f'merged_{time.time()}{self.image_processor.output_extension}')
+            success = self.image_executor.run(self.image_processor.combine_images, temp_files, merged_image_path, timeout=self.image_timeout)
             
             if success:
                 # 发送合并后的图片
@@ -1651,104 +2598,46 @@ class TongyiDrawingPlugin(Plugin):
             except Exception as e:
                 logger.error(f"[TYHH] 清理临时文件失败: {str(e)}")
 
-    def _parse_sketch_command(self, content):
-        """解析手绘命令参数"""
-        # 移除命令前缀
-        content = content[4:].strip()
-        
-        # 默认参数
-        resolution = "1024*1024"  # 默认1:1
-        style = "<flat illustration>"  # 默认扁平插画
-        
-        # 风格映射
-        style_mapping = {
-            "-扁平": "<flat illustration>",
-            "-油画": "<oil painting>",
-            "-二次元": "<anime>",
-            "-水彩": "<watercolor>",
-            "-3D": "<3d cartoon>",
-            "-彩绘": "<watercolor>"  # 添加彩绘风格映射
-        }
-        
-        # 比例映射 - 只保留支持的比例
-        ratio_mapping = {
-            "-1:1": "1024*1024",
-            "-16:9": "1280*720",
-            "-9:16": "720*1280"
-        }
-
-        # 先找出所有参数的位置
-        param_positions = []
-        for param in list(ratio_mapping.keys()) + list(style_mapping.keys()):
-            pos = content.find(param)
-            if pos != -1:
-                param_positions.append((pos, param))
-        
-        # 按位置排序
-        param_positions.sort()
-        
-        # 如果没有找到任何参数，整个内容就是提示词
-        if not param_positions:
-            prompt = content
-        else:
-            # 提取提示词（第一个参数之前的所有内容）
-            prompt = content[:param_positions[0][0]].strip()
-            
-            # 处理参数
-            for pos, param in param_positions:
-                if param in ratio_mapping:
-                    resolution = ratio_mapping[param]
-                elif param in style_mapping:
-                    style = style_mapping[param]
-        
-        logger.info(f"[TYHH] 解析命令结果: prompt='{prompt}', resolution='{resolution}', style='{style}'")
-        return prompt, resolution, style
-
-    def _preprocess_sketch_image(self, image_path):
+    def _normalize_upload_image(self, image_path, resolution="1024*1024"):
         """
-        预处理涂鸦图片，将白底彩色线条转换为黑底白线
+        规范化用户上传的图片：缩小到任务分辨率、去除元数据并重新编码
+        返回处理后的图片数据
         """
         try:
-            from PIL import Image
-            import numpy as np
-            
-            # 打开图片
-            img = Image.open(image_path)
+            from .image_processor import ImageProcessor
             
-            # 转换为RGBA格式（如果不是的话）
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-                
-            # 转换为numpy数组以便处理
-            data = np.array(img)
-            
-            # 创建一个新的全黑图像
-            new_data = np.zeros_like(data)
-            
-            # 获取alpha通道
-            alpha = data[:, :, 3]
-            
-            # 计算RGB通道的平均值（用于检测非白色区域）
-            rgb_mean = data[:, :, :3].mean(axis=2)
-            
-            # 创建掩码：
-            # 1. alpha > 0 表示非透明区域
-            # 2. rgb_mean < 240 表示非白色区域（允许一些容差）
-            mask = (alpha > 0) & (rgb_mean < 240)
-            
-            # 将掩码区域设置为白色，其他区域保持黑色
-            new_data[mask] = [255, 255, 255, 255]  # 白色，完全不透明
-            new_data[~mask] = [0, 0, 0, 255]  # 黑色，完全不透明
-            
-            # 创建新图像
-            processed_img = Image.fromarray(new_data)
+            with open(image_path, 'rb') as f:
+                data = f.read()
             
-            # 保存处理后的图片
-            temp_dir = os.path.dirname(image_path)
-            processed_path = os.path.join(temp_dir, f"processed_{os.path.basename(image_path)}")
-            processed_img.save(processed_path, 'PNG')
+            target_size = tuple(map(int, resolution.split('*')))
+            normalized = self.image_executor.run_with_buffer(ImageProcessor.normalize_upload, data, target_size, timeout=self.image_timeout)
+            logger.info(f"[TYHH] 上传图片规范化: {len(data)} -> {len(normalized)} 字节")
+            return normalized
+        except Exception as e:
+            logger.error(f"[TYHH] 规范化上传图片失败: {e}")
+            return None
+
+    def _preprocess_sketch_image(self, image_path, resolution="1024*1024"):
+        """
+        预处理涂鸦图片，缩小到目标分辨率后将白底彩色线条转换为黑底白线
+        返回处理后的PNG数据，不落盘
+        """
+        try:
+            from .image_processor import ImageProcessor
             
-            return processed_path
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            
+            # 在图片处理进程池中执行
+            target_size = tuple(map(int, resolution.split('*')))
+            processed_data = self.image_executor.run_with_buffer(
+                ImageProcessor.preprocess_sketch,
+                data,
+                target_size,
+                self.config.get("sketch_output_mode", "L"),
+                timeout=self.image_timeout
+            )
+            return processed_data or None
         except Exception as e:
             logger.error(f"[TYHH] 处理涂鸦图片失败: {e}")
             return None